@@ -0,0 +1,492 @@
+"""Stockage des statistiques d'utilisation du bot"""
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+
+class RingBuffer:
+    """Buffer circulaire de taille fixe : ajout en O(1), lecture du plus récent au plus ancien.
+
+    Chaque élément reçoit un numéro de séquence croissant (`seq`), ce qui permet
+    de le retrouver en O(1) tant qu'il n'a pas été écrasé. Les lectures sont sûres
+    pendant qu'un autre thread écrit : un emplacement écrasé en cours de lecture
+    est détecté grâce à sa séquence et la lecture s'arrête là.
+    """
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("RingBuffer : la capacité doit être > 0")
+        self.capacity = capacity
+        self._slots = [None] * capacity  # [(seq, item)]
+        self._next_seq = 0  # Séquence du prochain élément ajouté
+
+    def append(self, item):
+        seq = self._next_seq
+        self._slots[seq % self.capacity] = (seq, item)
+        self._next_seq = seq + 1
+
+    def __len__(self):
+        return min(self._next_seq, self.capacity)
+
+    @property
+    def first_seq(self):
+        """Séquence du plus ancien élément encore présent"""
+        return self._next_seq - len(self)
+
+    @property
+    def last_seq(self):
+        """Séquence du plus récent élément (-1 si vide)"""
+        return self._next_seq - 1
+
+    def get(self, seq):
+        """Élément de séquence `seq`, ou None s'il a été écrasé / n'existe pas encore"""
+        if seq < 0:
+            return None
+        slot = self._slots[seq % self.capacity]
+        if slot is not None and slot[0] == seq:
+            return slot[1]
+        return None
+
+    def iter_newest(self, before_seq=None):
+        """Parcourt les éléments du plus récent au plus ancien, sans copie.
+
+        `before_seq` limite aux éléments de séquence strictement inférieure.
+        Renvoie des couples (seq, item).
+        """
+        end = self._next_seq if before_seq is None else min(before_seq, self._next_seq)
+        slots, capacity = self._slots, self.capacity
+        for seq in range(end - 1, max(end - capacity, 0) - 1, -1):
+            slot = slots[seq % capacity]
+            if slot is None or slot[0] != seq:
+                return  # Écrasé par un ajout plus récent
+            yield slot
+
+    def __iter__(self):
+        for _, item in self.iter_newest():
+            yield item
+
+class Leaderboard:
+    """Classement incrémental : +1 / -1 en O(1), lecture du top K en O(K).
+
+    Les clés sont rangées dans des paniers par compteur ({count: {key: None}}),
+    les compteurs non vides étant chaînés dans les deux sens (structure « LFU »).
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._buckets = {}
+        # Liste chaînée des compteurs non vides ; 0 sert de sentinelle en bas de la liste
+        self._up = {0: None}  # {count: compteur non vide immédiatement supérieur}
+        self._down = {}       # {count: compteur non vide immédiatement inférieur}
+        self._max = 0
+        self.total = 0  # Somme des compteurs
+
+    def __len__(self):
+        return len(self._counts)
+
+    def count(self, key):
+        return self._counts.get(key, 0)
+
+    def _link(self, below, new):
+        """Insère le panier `new` juste au-dessus du compteur `below`"""
+        above = self._up[below]
+        self._up[below] = new
+        self._down[new] = below
+        self._up[new] = above
+        if above is not None:
+            self._down[above] = new
+        else:
+            self._max = new
+
+    def _unlink(self, count):
+        below, above = self._down.pop(count), self._up.pop(count)
+        del self._buckets[count]
+        self._up[below] = above
+        if above is not None:
+            self._down[above] = below
+        else:
+            self._max = below
+
+    def incr(self, key):
+        old = self._counts.get(key, 0)
+        new = old + 1
+        self._counts[key] = new
+        self.total += 1
+        if new not in self._buckets:
+            self._buckets[new] = {}
+            self._link(old, new)
+        self._buckets[new][key] = None
+        if old:
+            bucket = self._buckets[old]
+            del bucket[key]
+            if not bucket:
+                self._unlink(old)
+
+    def decr(self, key):
+        old = self._counts[key]
+        new = old - 1
+        self.total -= 1
+        if new:
+            self._counts[key] = new
+            if new not in self._buckets:
+                self._buckets[new] = {}
+                self._link(self._down[old], new)
+            self._buckets[new][key] = None
+        else:
+            del self._counts[key]
+        bucket = self._buckets[old]
+        del bucket[key]
+        if not bucket:
+            self._unlink(old)
+
+    def load(self, counts):
+        """Remplace le contenu par {key: count} (restauration au démarrage)"""
+        self.__init__()
+        for key, count in sorted(counts.items(), key=lambda kv: kv[1]):
+            if count <= 0:
+                continue
+            self._counts[key] = count
+            self.total += count
+            if count not in self._buckets:
+                self._buckets[count] = {}
+                self._link(self._max, count)
+            self._buckets[count][key] = None
+
+    def top(self, k):
+        """Les k meilleures clés : [(key, count)], du plus grand compteur au plus petit"""
+        out = []
+        count = self._max
+        while count and len(out) < k:
+            for key in self._buckets[count]:
+                out.append((key, count))
+                if len(out) == k:
+                    break
+            count = self._down[count]
+        return out
+
+class _CommandLeaderboards:
+    """Classement global + un classement par commande"""
+
+    def __init__(self):
+        self.all = Leaderboard()
+        self.by_command = {}
+
+    def incr(self, user_id, command):
+        self.all.incr(user_id)
+        board = self.by_command.get(command)
+        if board is None:
+            board = self.by_command[command] = Leaderboard()
+        board.incr(user_id)
+
+    def decr(self, user_id, command):
+        self.all.decr(user_id)
+        board = self.by_command[command]
+        board.decr(user_id)
+        if not len(board):
+            del self.by_command[command]
+
+    def board(self, command=None):
+        if command is None:
+            return self.all
+        return self.by_command.get(command)
+
+# Fenêtres glissantes disponibles pour les classements (calculés à la lecture, sur l'historique)
+WINDOWS = {"hour": 3600, "day": 86400}
+
+@dataclass(frozen=True)
+class UsageSnapshot:
+    """Vue figée des statistiques à un instant donné (`version` = nb d'écritures)"""
+    version: int
+    total_commands: int
+    unique_users: int
+    top_users: tuple  # ((name, count), ...) du plus actif au moins actif
+    command_counts: tuple  # ((command, count), ...) depuis le début
+    history_seq: int  # Dernière séquence d'historique visible dans ce snapshot
+    _history: RingBuffer
+
+    def history(self, limit=None):
+        """Historique du plus récent au plus ancien : [{"user", "command", "ts"}]"""
+        for n, (_, entry) in enumerate(self._history.iter_newest(self.history_seq + 1)):
+            if limit is not None and n >= limit:
+                return
+            yield entry
+
+    def page(self, before=None, user=None, command=None, since=None, until=None):
+        """Historique filtré, du plus récent au plus ancien : couples (seq, entry).
+
+        `before` est un curseur (séquence exclue) : la séquence de la dernière ligne
+        d'une page donne la page suivante. `user` compare le pseudo sans casse,
+        `command` accepte aussi un préfixe ("roll" pour roll_bague...), `since`/`until`
+        bornent les timestamps. L'historique étant chronologique, le parcours
+        s'arrête dès qu'on passe sous `since`.
+        """
+        end = self.history_seq + 1 if before is None else min(before, self.history_seq + 1)
+        user = user.lower() if user else None
+        prefix = f"{command}_" if command else None
+        for seq, entry in self._history.iter_newest(end):
+            ts = entry["ts"]
+            if until is not None and ts >= until:
+                continue
+            if since is not None and ts < since:
+                return
+            if user is not None and entry["user"].lower() != user:
+                continue
+            if command and entry["command"] != command and not entry["command"].startswith(prefix):
+                continue
+            yield seq, entry
+
+class AnalyticsStore:
+    """Statistiques partagées entre la boucle asyncio du bot (écrivain) et le thread web (lecteurs).
+
+    Les écritures passent par une section critique de quelques opérations.
+    Les lecteurs obtiennent un UsageSnapshot immuable, mis en cache tant que
+    rien n'a changé : ils ne bloquent jamais la boucle du bot.
+    Les classements global et par commande sont tenus à jour à chaque écriture,
+    aucune lecture ne trie l'ensemble des utilisateurs. Les classements par fenêtre
+    (WINDOWS), rarement lus, sont comptés à la demande sur l'historique : l'écriture
+    ne les paie pas.
+    """
+
+    def __init__(self, history_capacity=10000, top_k=10):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._total_commands = 0
+        self._names = {}  # {user_id: name}
+        self._history = RingBuffer(history_capacity)
+        self._boards = _CommandLeaderboards()
+        self.top_k = top_k
+        self._snapshot = None
+        self.journal = None  # UsageJournal optionnel, branché par attach_journal()
+
+    def record(self, user_id, user_name, command, ts=None):
+        ts = time.time() if ts is None else ts
+        entry = {"user": user_name, "command": command, "ts": ts}
+        with self._lock:
+            self._total_commands += 1
+            self._names[user_id] = user_name
+            self._boards.incr(user_id, command)
+            self._history.append(entry)
+            self._version += 1
+            if self.journal is not None:
+                self.journal.append((self._total_commands, ts, user_id, user_name, command))
+
+    @property
+    def version(self):
+        return self._version
+
+    def _top(self, board, k):
+        if board is None:
+            return []
+        names = self._names
+        return [(names[user_id], count) for user_id, count in board.top(k)]
+
+    def top_users(self, k=None, command=None, window=None):
+        """Top k utilisateurs [(name, count)], tous temps confondus ou sur une fenêtre de WINDOWS.
+
+        Tous temps : `command` est un nom exact (roll_bague). Sur une fenêtre, le comptage
+        parcourt l'historique en mémoire (au plus history_capacity commandes) et `command`
+        accepte un préfixe, comme UsageSnapshot.page.
+        """
+        k = self.top_k if k is None else k
+        if window is None:
+            with self._lock:
+                return self._top(self._boards.board(command), k)
+        since = time.time() - WINDOWS[window]
+        counts = Counter(entry["user"] for _, entry in self.snapshot().page(command=command, since=since))
+        return counts.most_common(k)
+
+    def snapshot(self):
+        cached = self._snapshot
+        if cached is not None and cached.version == self._version:
+            return cached
+        with self._lock:
+            snap = UsageSnapshot(
+                version=self._version,
+                total_commands=self._total_commands,
+                unique_users=len(self._names),
+                top_users=tuple(self._top(self._boards.all, self.top_k)),
+                command_counts=tuple((command, board.total) for command, board in self._boards.by_command.items()),
+                history_seq=self._history.last_seq,
+                _history=self._history,
+            )
+        self._snapshot = snap
+        return snap
+
+    # --- Persistance ---
+    def attach_journal(self, journal):
+        self.journal = journal
+
+    def export_state(self):
+        """État complet sérialisable (compteurs par commande + historique), pour UsageJournal"""
+        with self._lock:
+            return {
+                "total_commands": self._total_commands,
+                "names": list(self._names.items()),
+                "counts": {command: list(board._counts.items()) for command, board in self._boards.by_command.items()},
+                "history": [entry for _, entry in reversed(list(self._history.iter_newest()))],
+            }
+
+    def restore(self, state, tail):
+        """Recharge un état exporté puis rejoue les événements postérieurs (`tail`).
+        Les événements sont des tuples (seq, ts, user_id, user_name, command).
+        """
+        with self._lock:
+            if state is not None:
+                self._total_commands = state["total_commands"]
+                self._names = dict(state["names"])
+                totals = {}
+                for command, counts in state["counts"].items():
+                    self._boards.by_command[command] = board = Leaderboard()
+                    board.load(dict(counts))
+                    for user_id, count in counts:
+                        totals[user_id] = totals.get(user_id, 0) + count
+                self._boards.all.load(totals)
+                for entry in state["history"]:
+                    self._history.append(entry)
+
+            for seq, ts, user_id, user_name, command in tail:
+                self._total_commands = seq
+                self._names[user_id] = user_name
+                self._boards.incr(user_id, command)
+                self._history.append({"user": user_name, "command": command, "ts": ts})
+            self._version += 1
+
+class UsageJournal:
+    """Persistance des statistiques dans SQLite (mode WAL), sans I/O sur le chemin de log_usage.
+
+    Les événements sont mis en file puis écrits par lots par un thread dédié,
+    tous les `flush_every` événements ou toutes les `flush_interval` secondes.
+    Tous les `compact_every` événements, l'état complet est sauvegardé et les
+    événements déjà couverts sont supprimés :
+    au redémarrage on ne rejoue que la fin du journal.
+    Une erreur SQLite (disque plein, base verrouillée) est journalisée et le lot
+    retenté au passage suivant ; au-delà de `max_pending` événements en attente,
+    les nouveaux sont abandonnés (la compaction suivante repart de l'état complet).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            seq INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            user_id INTEGER NOT NULL,
+            user_name TEXT NOT NULL,
+            command TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS snapshot (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_commands INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path, flush_every=256, flush_interval=5.0, compact_every=100_000, max_pending=100_000):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self.max_pending = max_pending
+        self._pending = deque()  # [(seq, ts, user_id, user_name, command)]
+        self._retry = []  # Lot dont l'écriture a échoué, réécrit en premier
+        self.dropped = 0
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._store = None
+        self._since_compact = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.SCHEMA)
+        return conn
+
+    def load(self):
+        """Lit le disque : (état | None, événements après l'état)"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT total_commands, data FROM snapshot WHERE id = 1").fetchone()
+            state = json.loads(row[1]) if row else None
+            since = row[0] if row else 0
+            tail = conn.execute("SELECT * FROM events WHERE seq > ? ORDER BY seq", (since,)).fetchall()
+            self._since_compact = len(tail)
+            return state, tail
+        finally:
+            conn.close()
+
+    def append(self, event):
+        if len(self._pending) + len(self._retry) >= self.max_pending:
+            # Écriture bloquée depuis longtemps : on ne laisse pas la mémoire grossir sans fin
+            if not self.dropped:
+                print(f"⚠️ [LOG] {self.max_pending} événements en attente d'écriture : les suivants sont abandonnés")
+            self.dropped += 1
+            return
+        self._pending.append(event)
+        if len(self._pending) >= self.flush_every:
+            self._wakeup.set()
+
+    def start(self, store):
+        self._store = store
+        store.attach_journal(self)
+        self._thread = threading.Thread(target=self._run, name="usage-journal", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Dernière écriture + compaction, puis arrêt du thread"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        conn = None
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            conn = self._write(conn, compact=self._since_compact >= self.compact_every)
+        conn = self._write(conn, compact=True)
+        if conn is not None:
+            conn.close()
+
+    def _write(self, conn, compact):
+        """Un passage d'écriture ; renvoie la connexion, ou None après une erreur (reconnexion au passage suivant)"""
+        try:
+            if conn is None:
+                conn = self._connect()
+            self._flush(conn)
+            if compact:
+                self._compact(conn)
+            return conn
+        except sqlite3.Error as e:
+            print(f"⚠️ [LOG] Écriture des stats échouée ({len(self._retry) + len(self._pending)} en attente) : {e}")
+            if conn is not None:
+                conn.close()
+            return None
+
+    def _flush(self, conn):
+        batch = self._retry  # Gardé tel quel si l'écriture échoue
+        pending = self._pending
+        while pending:
+            batch.append(pending.popleft())
+        if not batch:
+            return
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)", batch)
+        self._retry = []
+        self._since_compact += len(batch)
+
+    def _compact(self, conn):
+        state = self._store.export_state()
+        # Les événements encore en file sont postérieurs à l'état : on les écrit d'abord
+        self._flush(conn)
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshot VALUES (1, ?, ?)",
+                (state["total_commands"], json.dumps(state, separators=(",", ":"))),
+            )
+            conn.execute("DELETE FROM events WHERE seq <= ?", (state["total_commands"],))
+        self._since_compact = 0
@@ -0,0 +1,352 @@
+"""Benchmarks hors ligne du bot (calculs, analytics, modals, routes web).
+
+    python bench.py                 # mesure et compare à bench_baseline.json s'il existe
+    python bench.py --save          # mesure et enregistre la référence
+    python bench.py -k calc -k web  # seulement les benchmarks dont le nom contient "calc" ou "web"
+
+Sortie en erreur (code 1) si un benchmark est plus lent que la référence de plus de --threshold.
+Aucun accès réseau : les interactions Discord sont simulées.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+# Avant d'importer bot : pas de fichier SQLite
+os.environ.setdefault("ANALYTICS_DB", "")
+
+import discord
+import bot
+
+BASELINE_FILE = os.path.join(bot.BASE_DIR, "bench_baseline.json")
+DEFAULT_THRESHOLD = 0.25  # +25 % par rapport à la référence = régression
+
+# === INTERACTIONS SIMULÉES ===
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"bench{user_id}"
+        self.display_name = self.name
+        self.discriminator = "0"
+
+class FakeResponse:
+    """Remplace InteractionResponse : garde seulement la trace des envois"""
+
+    def __init__(self):
+        self._done = False
+        self.sent = []
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, thinking=False, ephemeral=False):
+        self._done = True
+        self.sent.append(("defer", {}))
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        self.sent.append(("send_message", {"content": content, **kwargs}))
+
+    async def send_modal(self, modal):
+        self._done = True
+        self.sent.append(("send_modal", {"modal": modal}))
+
+class FakeFollowup:
+    def __init__(self, response):
+        self._response = response
+
+    async def send(self, content=None, **kwargs):
+        self._response.sent.append(("followup", {"content": content, **kwargs}))
+
+class FakeMessage:
+    async def delete(self):
+        pass
+
+class FakeInteraction(discord.Interaction):
+    """Interaction sans connexion : seuls les attributs lus par les handlers du bot existent"""
+
+    def __init__(self, user_id=1, custom_id=None):
+        self.id = discord.utils.time_snowflake(discord.utils.utcnow())
+        self.user = FakeUser(user_id)
+        self.extras = {}
+        self.data = {"custom_id": custom_id} if custom_id else {}
+        self.message = FakeMessage()
+        self.response = FakeResponse()
+        self.followup = FakeFollowup(self.response)
+
+    @property
+    def created_at(self):
+        return discord.utils.snowflake_time(self.id)
+
+    async def delete_original_response(self):
+        self.response.sent.append(("delete_original", {}))
+
+def fill_modal(modal, *values):
+    """Renseigne les champs d'un modal dans l'ordre d'affichage"""
+    for item, value in zip(modal.children, values):
+        item._value = value
+    return modal
+
+# === BENCHMARKS ===
+# Chaque entrée est une fabrique : elle prépare ses données puis renvoie la fonction mesurée
+# (une coroutine si async_=True).
+BENCHMARKS = {}
+
+def benchmark(name, async_=False):
+    def decorator(factory):
+        BENCHMARKS[name] = (factory, async_)
+        return factory
+    return decorator
+
+def _gear_bases(n, seed=42):
+    """(pièce, base) en alternant les 6 pièces, chaque base tirée dans la plage réaliste de son type"""
+    rng = random.Random(seed)
+    keys = [bot.GEAR_KEYS[i % 6] for i in range(n)]
+    return keys, [rng.randint(*bot.PIVOT_TABLE_RANGES[bot.GEAR_DATA[k]["type"]]) for k in keys]
+
+@benchmark("calc.pivot_old")
+def bench_pivot_old():
+    keys, bases = _gear_bases(600)
+    def run():
+        for key, base in zip(keys, bases):
+            bot.calculate_pivot_old(key, base)
+    return run
+
+@benchmark("calc.pivot_7ds")
+def bench_pivot_7ds():
+    keys, bases = _gear_bases(600)
+    def run():
+        for key, base in zip(keys, bases):
+            bot.calculate_pivot_7ds(key, 95, base)
+    return run
+
+@benchmark("calc.pivots_batch")
+def bench_pivots_batch():
+    keys, bases = _gear_bases(600)
+    return lambda: bot.calculate_pivots_batch(keys, bases, 95)
+
+def _table_benchmark(pct):
+    def factory():
+        # Table dédiée (PIVOT_TABLE peut être désactivée) ; un premier passage construit les blocs lus
+        table = bot.PivotTable()
+        keys, bases = _gear_bases(600)
+        def run():
+            for key, base in zip(keys, bases):
+                table.lookup(key, base, pct)
+        run()
+        return run
+    return factory
+
+benchmark("calc.table_old")(_table_benchmark(None))   # À comparer à calc.pivot_old
+benchmark("calc.table_7ds")(_table_benchmark(95.0))   # À comparer à calc.pivot_7ds (95 % : sur la grille)
+
+@benchmark("calc.roll_odds")
+def bench_roll_odds():
+    return lambda: bot.roll_odds(11.42, 3.0)
+
+@benchmark("analytics.log_usage")
+def bench_log_usage():
+    # Charge soutenue : 10 000 utilisateurs qui reviennent à tour de rôle, 1000 commandes par appel
+    interactions = itertools.cycle([FakeInteraction(user_id) for user_id in range(10_000)])
+    commands = ("pivot", "roll_bague", "stuff", "help")
+    def run():
+        with contextlib.redirect_stdout(None):  # print() de log_usage : mesuré sans le terminal
+            for i in range(1000):
+                bot.log_usage(next(interactions), commands[i % 4])
+    return run
+
+@benchmark("embed.help_build")
+def bench_help_build():
+    return bot.build_help_template
+
+@benchmark("embed.farm_build")
+def bench_farm_build():
+    results, scenario = bot.farm_model.rank(), bot.farm_model.DEFAULT_SCENARIO
+    return lambda: bot.farm_embed(results, scenario)
+
+@benchmark("modal.pivot", async_=True)
+def bench_pivot_modal():
+    async def run():
+        modal = fill_modal(bot.PivotModal(), "207152", "90182", "13836", "5581")
+        with contextlib.redirect_stdout(None):
+            await modal.on_submit(FakeInteraction())
+    return run
+
+@benchmark("modal.roll", async_=True)
+def bench_roll_modal():
+    async def run():
+        modal = fill_modal(bot.RollModal("bague", FakeMessage()), "13836", "5581", "100", "3")
+        with contextlib.redirect_stdout(None):
+            await modal.on_submit(FakeInteraction())
+    return run
+
+@benchmark("command.help", async_=True)
+def bench_help_command():
+    callback = bot.tree.get_command("help").callback
+    async def run():
+        with contextlib.redirect_stdout(None):
+            await callback(FakeInteraction())
+    return run
+
+@benchmark("command.farm", async_=True)
+def bench_farm_command():
+    callback = bot.tree.get_command("farm").callback
+    return lambda: callback(FakeInteraction())
+
+WEB_ROUTES = ("/", "/guide", "/farming", "/stats", "/stats.json", "/perf", "/perf.json", "/metrics", "/health", "/assets/style.css")
+
+def _route_benchmark(path):
+    def factory():
+        client = bot.app.test_client()
+        def run():
+            response = client.get(path, headers={"Accept-Encoding": "gzip, br"})
+            response.get_data()
+            response.close()
+        return run
+    return factory
+
+for _path in WEB_ROUTES:
+    benchmark(f"web.{_path.strip('/') or 'home'}")(_route_benchmark(_path))
+
+# === MESURE ===
+def measure(run, min_time=0.05, repeat=5):
+    """Temps par appel (ns), le meilleur de `repeat` séries calibrées à ~min_time chacune"""
+    loops = 1
+    elapsed = run(loops)
+    while elapsed < min_time:
+        # Extrapolation du nombre d'appels nécessaires, au plus x100 d'un coup
+        loops = min(loops * 100, int(loops * min_time * 1.2 / max(elapsed, 1e-9)) + 1)
+        elapsed = run(loops)
+    best = min([elapsed] + [run(loops) for _ in range(repeat - 1)])
+    return best / loops * 1e9, loops
+
+def sync_runner(fn):
+    def run(loops):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        return time.perf_counter() - started
+    return run
+
+def async_runner(loop, fn):
+    async def timed(loops):
+        started = time.perf_counter()
+        for _ in range(loops):
+            await fn()
+        return time.perf_counter() - started
+    return lambda loops: loop.run_until_complete(timed(loops))
+
+def seed_analytics(users=2000, seed=42):
+    """Historique plein avant de mesurer : les pages /stats coûtent pareil quel que soit le filtre -k"""
+    rng = random.Random(seed)
+    now = time.time()
+    commands = ("pivot", "stuff", "help") + tuple(f"roll_{k}" for k in bot.GEAR_KEYS)
+    capacity = bot.ANALYTICS._history.capacity
+    for i in range(capacity):
+        user_id = rng.randrange(users)
+        bot.ANALYTICS.record(user_id, f"bench{user_id}", rng.choice(commands), ts=now - (capacity - i))
+
+def run_benchmarks(patterns=(), min_time=0.05, repeat=5):
+    """{nom: {"ns": temps par appel, "loops": appels par série}}"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def setup():
+        # Comme setup_hook : les vues et gabarits ont besoin de la boucle
+        bot.register_persistent_views()
+        bot.TEMPLATES.warm()
+    loop.run_until_complete(setup())
+    bot.IMAGES.reload()  # Comme __main__
+    seed_analytics()
+
+    results = {}
+    try:
+        for name, (factory, is_async) in BENCHMARKS.items():
+            if patterns and not any(p in name for p in patterns):
+                continue
+            if is_async:
+                fn = loop.run_until_complete(_build_async(factory))
+                runner = async_runner(loop, fn)
+            else:
+                runner = sync_runner(factory())
+            ns, loops = measure(runner, min_time, repeat)
+            results[name] = {"ns": round(ns, 1), "loops": loops}
+            print(f"  {name:<24} {format_ns(ns):>12}", flush=True)
+    finally:
+        loop.close()
+    return results
+
+async def _build_async(factory):
+    return factory()  # Fabriquées sur la boucle : certaines créent des View
+
+def format_ns(ns):
+    for unit, scale in (("s", 1e9), ("ms", 1e6), ("µs", 1e3)):
+        if ns >= scale:
+            return f"{ns / scale:.2f} {unit}"
+    return f"{ns:.0f} ns"
+
+def compare(results, baseline, threshold):
+    """Liste des régressions [(nom, référence ns, actuel ns)]"""
+    regressions = []
+    print(f"\n{'benchmark':<26}{'référence':>12}{'actuel':>12}{'écart':>9}")
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            print(f"{name:<26}{'-':>12}{format_ns(current['ns']):>12}{'nouveau':>9}")
+            continue
+        delta = current["ns"] / reference["ns"] - 1
+        flag = " ⚠️" if delta > threshold else ""
+        print(f"{name:<26}{format_ns(reference['ns']):>12}{format_ns(current['ns']):>12}{delta:>+9.0%}{flag}")
+        if delta > threshold:
+            regressions.append((name, reference["ns"], current["ns"]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks du Lampa Calculator")
+    parser.add_argument("-k", dest="patterns", action="append", default=[], help="Filtre sur le nom (répétable)")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Fichier JSON de référence")
+    parser.add_argument("--save", action="store_true", help="Enregistre les résultats comme référence")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("BENCH_THRESHOLD", DEFAULT_THRESHOLD)),
+                        help="Ralentissement toléré (0.25 = +25 %%)")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Durée minimale d'une série (s)")
+    parser.add_argument("--repeat", type=int, default=5, help="Séries par benchmark (on garde la meilleure)")
+    args = parser.parse_args(argv)
+
+    print(f"⏱️ Benchmarks (Python {platform.python_version()}, {platform.machine()})")
+    results = run_benchmarks(args.patterns, args.min_time, args.repeat)
+
+    if args.save:
+        try:
+            with open(args.baseline, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            saved = {}
+        saved.setdefault("results", {}).update(results)
+        saved["python"] = platform.python_version()
+        saved["machine"] = platform.machine()
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+        print(f"\n💾 Référence enregistrée : {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    except FileNotFoundError:
+        print(f"\nPas de référence ({args.baseline}) : lancer avec --save pour en créer une")
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ {len(regressions)} régression(s) au-delà de +{args.threshold:.0%}")
+        return 1
+    print(f"\n✅ Aucune régression au-delà de +{args.threshold:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,11 +2,44 @@ import discord
 from discord import app_commands
 from discord.ui import Button, View, Modal, TextInput
 import traceback
+import atexit
 import os
+import asyncio
 import datetime
+import hashlib
+import io
+import math
+import json
+import gzip
+import signal
+import time
+import zlib
+from array import array
+from collections import OrderedDict, namedtuple
+from dataclasses import replace
+from functools import partial, wraps
+from itertools import islice
+from urllib.parse import parse_qs, urlencode, urlparse
 from dotenv import load_dotenv
-from flask import Flask, render_template_string
+from flask import Flask, Response, abort, g, request
+from markupsafe import escape
+from aiohttp import web
 from threading import Thread
+from analytics import WINDOWS, AnalyticsStore, UsageJournal
+from telemetry import Telemetry
+import farming as farm_model
+try:
+    import brotli
+except ImportError:  # Brotli optionnel : gzip seul
+    brotli = None
+try:
+    from PIL import Image
+except ImportError:  # Pillow optionnel : pas de miniatures réduites
+    Image = None
+try:
+    from waitress import serve as waitress_serve
+except ImportError:  # Repli sur le serveur de dev Werkzeug
+    waitress_serve = None
 
 # === CONFIGURATION ===
 load_dotenv()
@@ -17,34 +50,56 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 IMAGES_DIR = os.path.join(BASE_DIR, "images")
 
 # === ANALYTICS (Mémoire simple) ===
-USAGE_STATS = {
-    "total_commands": 0,
-    "users": {},  # {user_id: {"name": str, "count": int}}
-    "history": [] # [{"user": str, "command": str, "time": str}]
-}
+HISTORY_CAPACITY = int(os.getenv("HISTORY_CAPACITY", "10000"))
+STATS_HISTORY_ROWS = 50  # Lignes d'historique affichées sur /stats
+
+# Fichier SQLite des stats (vide = pas de persistance)
+ANALYTICS_DB = os.getenv("ANALYTICS_DB", os.path.join(BASE_DIR, "analytics.db"))
+
+# Écrit par la boucle du bot, lu par le thread Flask via des snapshots
+ANALYTICS = AnalyticsStore(HISTORY_CAPACITY)
+
+def start_analytics_journal():
+    """Recharge les stats sauvegardées puis lance l'écriture différée sur disque"""
+    if not ANALYTICS_DB:
+        return None
+    journal = UsageJournal(ANALYTICS_DB)
+    started = time.perf_counter()
+    ANALYTICS.restore(*journal.load())
+    print(f"📊 [LOG] Stats restaurées en {(time.perf_counter() - started) * 1000:.0f} ms ({ANALYTICS.snapshot().total_commands} commandes)")
+    journal.start(ANALYTICS)
+    atexit.register(journal.close)
+    return journal
 
 def log_usage(interaction: discord.Interaction, command_name: str):
     """Enregistre l'utilisation d'une commande"""
     user = interaction.user
     user_name = f"{user.name}#{user.discriminator}" if user.discriminator != "0" else user.name
     
-    USAGE_STATS["total_commands"] += 1
-    
-    # Update user stats
-    if user.id not in USAGE_STATS["users"]:
-        USAGE_STATS["users"][user.id] = {"name": user_name, "count": 0}
-    USAGE_STATS["users"][user.id]["count"] += 1
-    
-    # Add to history (garder les 50 derniers)
-    USAGE_STATS["history"].insert(0, {
-        "user": user_name,
-        "command": command_name,
-        "time": datetime.datetime.now().strftime("%d/%m %H:%M")
-    })
-    USAGE_STATS["history"] = USAGE_STATS["history"][:50]
+    ANALYTICS.record(user.id, user_name, command_name)
     
     print(f"📊 [LOG] {user_name} used /{command_name}")
 
+# === TÉLÉMÉTRIE (temps de réponse) ===
+# Part des spans mesurés : 1 = tous, 0 = instrumentation coupée
+TELEMETRY_SAMPLE_RATE = float(os.getenv("TELEMETRY_SAMPLE_RATE", "1"))
+TELEMETRY = Telemetry(TELEMETRY_SAMPLE_RATE)
+
+# --- RETARD DE LA BOUCLE ASYNCIO ---
+LOOP_LAG_INTERVAL = 1.0  # Secondes entre deux mesures
+LOOP_LAG = {"current": 0.0, "max": 0.0}  # Secondes ; lu par /metrics depuis le thread web
+
+async def monitor_loop_lag():
+    """Mesure le retard de réveil d'un sleep : temps pendant lequel la boucle était bloquée"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(loop.time() - started - LOOP_LAG_INTERVAL, 0.0)
+        LOOP_LAG["current"] = lag
+        if lag > LOOP_LAG["max"]:
+            LOOP_LAG["max"] = lag
+
 # === DONNÉES 7DS ===
 GEAR_DATA = {
     "ceinture": {"ssr": 12400, "r": 5400, "type": "HP", "emoji": "🛡️", "color": 0x3498db, "image": "icon_weapon_2_belt.jpg"},
@@ -61,6 +116,147 @@ intents = discord.Intents.default()
 client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
 
+# === IMAGES (chargées en mémoire au démarrage) ===
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "0"))  # Côté max (px) des miniatures réduites ; 0 = image d'origine
+
+class ImageStore:
+    """Images de GEAR_DATA gardées en mémoire : plus aucun accès disque par /roll.
+
+    `reload()` relit IMAGES_DIR (au démarrage, puis à la demande si les fichiers changent),
+    signale les images manquantes et renvoie les noms dont le contenu a changé.
+    """
+
+    def __init__(self, directory, thumbnail_size=0):
+        self.directory = directory
+        self.thumbnail_size = thumbnail_size
+        self._images = {}  # {filename: bytes} (miniature réduite si disponible)
+        self.missing = []
+
+    def _downscale(self, data):
+        if not self.thumbnail_size or Image is None:
+            return data
+        img = Image.open(io.BytesIO(data))
+        fmt = img.format
+        img.thumbnail((self.thumbnail_size, self.thumbnail_size))
+        out = io.BytesIO()
+        img.save(out, format=fmt, quality=85)
+        return out.getvalue() if out.tell() < len(data) else data
+
+    def reload(self):
+        try:
+            present = {entry.name for entry in os.scandir(self.directory) if entry.is_file()}
+        except FileNotFoundError:
+            present = set()
+
+        images, missing = {}, []
+        for filename in dict.fromkeys(d["image"] for d in GEAR_DATA.values()):
+            if filename not in present:
+                missing.append(filename)
+                continue
+            with open(os.path.join(self.directory, filename), "rb") as f:
+                images[filename] = self._downscale(f.read())
+
+        changed = {name for name in images.keys() | self._images.keys() if images.get(name) != self._images.get(name)}
+        self._images, self.missing = images, missing
+        print(f"🖼️ Images chargées : {len(images)}/{len(images) + len(missing)}")
+        if missing:
+            print(f"⚠️ Images manquantes dans {self.directory} : {', '.join(missing)}")
+        return changed
+
+    def __contains__(self, filename):
+        return filename in self._images
+
+    def file(self, filename):
+        """discord.File construit depuis la mémoire, ou None si l'image manque"""
+        data = self._images.get(filename)
+        if data is None:
+            return None
+        return discord.File(io.BytesIO(data), filename=filename)
+
+IMAGES = ImageStore(IMAGES_DIR, THUMBNAIL_SIZE)  # Chargé au démarrage (__main__) : pas à l'import, que refont les workers
+
+def reload_images():
+    """Relit IMAGES_DIR et oublie les URLs CDN des images modifiées"""
+    for filename in IMAGES.reload():
+        THUMBNAILS.forget(filename)
+
+# === MINIATURES (CDN Discord) ===
+# Salon où les images de GEAR_DATA sont envoyées une fois ; leurs URLs CDN sont ensuite réutilisées
+THUMBNAIL_CHANNEL_ID = int(os.getenv("THUMBNAIL_CHANNEL_ID", "0"))
+THUMBNAIL_REFRESH_MARGIN = 3600  # Secondes avant expiration de l'URL signée où on la rafraîchit
+THUMBNAIL_DEFAULT_TTL = 12 * 3600  # Si l'URL n'indique pas son expiration (paramètre `ex`)
+
+class ThumbnailCache:
+    """URLs CDN des miniatures : chaque image est uploadée une seule fois dans THUMBNAIL_CHANNEL_ID.
+
+    `get_url` ne bloque jamais : en cas d'absence ou d'URL bientôt expirée, il lance
+    l'upload (ou le rafraîchissement) en tâche de fond et l'appelant se replie sur
+    une pièce jointe classique.
+    """
+
+    def __init__(self, channel_id):
+        self.channel_id = channel_id
+        self._entries = {}  # {filename: (url, expires_at, message_id)}
+        self._pending = {}  # {filename: asyncio.Task}
+
+    @staticmethod
+    def _expiry(url):
+        ex = parse_qs(urlparse(url).query).get("ex")
+        try:
+            return int(ex[0], 16)
+        except (TypeError, ValueError):
+            return time.time() + THUMBNAIL_DEFAULT_TTL
+
+    def get_url(self, filename):
+        """URL CDN valide pour `filename`, ou None (upload/rafraîchissement lancé en fond)"""
+        if not self.channel_id:
+            return None
+        entry = self._entries.get(filename)
+        now = time.time()
+        if entry is None or entry[1] - now < THUMBNAIL_REFRESH_MARGIN:
+            self._schedule(filename)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        return None
+
+    def _schedule(self, filename):
+        if filename not in self._pending:
+            task = asyncio.get_running_loop().create_task(self._resolve(filename))
+            self._pending[filename] = task
+            task.add_done_callback(lambda _: self._pending.pop(filename, None))
+
+    async def _resolve(self, filename):
+        try:
+            channel = client.get_channel(self.channel_id) or await client.fetch_channel(self.channel_id)
+            entry = self._entries.get(filename)
+            message = None
+            if entry is not None:
+                # Rafraîchir l'URL signée en relisant le message, sans ré-uploader
+                try:
+                    message = await channel.fetch_message(entry[2])
+                except discord.NotFound:
+                    message = None
+            if message is None or not message.attachments:
+                file = IMAGES.file(filename)
+                if file is None:
+                    return
+                message = await channel.send(file=file)
+            url = message.attachments[0].url
+            self._entries[filename] = (url, self._expiry(url), message.id)
+        except discord.HTTPException:
+            traceback.print_exc()
+
+    def forget(self, filename):
+        """Oublie l'URL d'une image (contenu modifié) : elle sera ré-uploadée"""
+        self._entries.pop(filename, None)
+
+    def warm(self):
+        """Lance l'upload des images de GEAR_DATA pas encore en cache (appelé à chaque on_ready)"""
+        for data in GEAR_DATA.values():
+            self.get_url(data["image"])
+
+THUMBNAILS = ThumbnailCache(THUMBNAIL_CHANNEL_ID)
+
 # === FONCTIONS CALCUL ===
 def calculate_pivot_old(gear_key, base_stat):
     data = GEAR_DATA[gear_key]
@@ -76,6 +272,281 @@ def calculate_pivot_7ds(gear_key, pct_stat_ssr, base_stat):
     pivot = ((r_total - base_stat - ssr_piece_stat) / base_stat) * 100
     return {'pivot': round(pivot, 2), 'rentable': pivot <= MAX_SUBSTAT}
 
+# --- CALCUL EN LOT (version colonnaire de GEAR_DATA) ---
+GEAR_DATA_VERSION = 0  # Incrémenté par update_gear : colonnes, table et gabarits se reconstruisent
+
+def _gear_columns():
+    keys = tuple(GEAR_DATA)
+    return (
+        keys,
+        {k: i for i, k in enumerate(keys)},
+        tuple(float(d["ssr"]) for d in GEAR_DATA.values()),
+        tuple(float(d["r"]) for d in GEAR_DATA.values()),
+    )
+
+GEAR_KEYS, GEAR_INDEX, GEAR_SSR, GEAR_R = _gear_columns()
+
+def _broadcast(values, n):
+    """Répète un scalaire n fois (les séquences sont renvoyées telles quelles)"""
+    if isinstance(values, (str, int, float)):
+        return (values,) * n
+    return values
+
+def calculate_pivots_batch(gear_keys, base_stats, pct_stats_ssr=None, rounded=True):
+    """Calcule tous les pivots et flags `rentable` en un seul passage.
+
+    `gear_keys`, `base_stats` et `pct_stats_ssr` sont des séquences de même longueur
+    (un scalaire est répété). Sans `pct_stats_ssr`, on applique la formule de
+    calculate_pivot_old (SSR 100%), sinon celle de calculate_pivot_7ds.
+    Une base à 0 donne un pivot de 0 au lieu de lever une erreur.
+    Renvoie (pivots, rentables).
+    """
+    lengths = [len(v) for v in (gear_keys, base_stats, pct_stats_ssr) if not isinstance(v, (str, int, float, type(None)))]
+    n = max(lengths) if lengths else 1
+    if any(l != n for l in lengths):
+        raise ValueError("calculate_pivots_batch : séquences de longueurs différentes")
+
+    idx = [GEAR_INDEX[k] for k in _broadcast(gear_keys, n)]
+    bases = _broadcast(base_stats, n)
+    ssr, r, max_sub = GEAR_SSR, GEAR_R, MAX_SUBSTAT
+
+    if pct_stats_ssr is None:
+        pivots = [max_sub - ((ssr[i] - r[i]) / b * 100) if b else 0.0 for i, b in zip(idx, bases)]
+    else:
+        pcts = _broadcast(pct_stats_ssr, n)
+        pivots = [
+            (((b + r[i] + (b * max_sub / 100)) - b - ssr[i] * (p / 100)) / b) * 100 if b else 0.0
+            for i, b, p in zip(idx, bases, pcts)
+        ]
+
+    rentables = [p <= max_sub for p in pivots]
+    if rounded:
+        pivots = [round(p, 2) for p in pivots]
+    return pivots, rentables
+
+def evaluate_loadout(bases, slots):
+    """Évalue plusieurs pièces en un seul passage.
+
+    `bases` : {"HP": base, "ATK": base, "DEF": base}
+    `slots` : {gear_key: (pct_stat_ssr, substat_actuel)}
+    Renvoie [{"gear", "pivot", "current", "missing", "rentable"}] trié de la pièce la plus
+    en retard sur son pivot (celle qui gagne le plus à être rollée) à la plus en avance,
+    les pièces non rentables (pivot > MAX_SUBSTAT, la R reste meilleure) en dernier.
+    """
+    keys = list(slots)
+    pivots, rentables = calculate_pivots_batch(
+        keys, [bases[GEAR_DATA[k]["type"]] for k in keys], [slots[k][0] for k in keys]
+    )
+    results = [
+        {"gear": k, "pivot": p, "current": slots[k][1], "missing": round(p - slots[k][1], 2), "rentable": r}
+        for k, p, r in zip(keys, pivots, rentables)
+    ]
+    results.sort(key=lambda res: (res["rentable"], res["missing"]), reverse=True)
+    return results
+
+def pivot_verdict(pivot):
+    """Libellé de difficulté affiché à côté d'un pivot"""
+    return "✅ Facile" if pivot < 10 else "⚖️ Moyen" if pivot < 13.5 else "⚠️ Dur"
+
+# --- TABLE DE PIVOTS PRÉCALCULÉE ---
+# Un bloc = (pièce, % SSR, n° de bloc) -> array('h') des pivots x100 pour PIVOT_TABLE_BLOCK bases entières.
+# Les blocs sont construits à la demande et évincés (LRU) au-delà du budget mémoire.
+# Désactivée par défaut : en CPython, un accès à la table (bloc chaud) reste plus lent que la formule
+# (voir `python bench.py -k calc`). PIVOT_TABLE=1 pour l'activer si une mesure montre le contraire.
+PIVOT_TABLE_ENABLED = os.getenv("PIVOT_TABLE", "0") == "1"
+PIVOT_TABLE_BUDGET_MB = float(os.getenv("PIVOT_TABLE_BUDGET_MB", "4"))
+PIVOT_TABLE_RANGES = {"HP": (50_000, 400_000), "ATK": (3_000, 30_000), "DEF": (1_000, 15_000)}
+PIVOT_TABLE_PCT_RANGE = (50.0, 100.0)
+PIVOT_TABLE_PCT_STEP = 0.5
+PIVOT_TABLE_BLOCK = 1024
+_OUT_OF_RANGE = -32768  # Pivot hors de la plage int16 -> formule exacte
+
+class PivotTable:
+    """Pivots en O(1) pour les bases courantes, avec repli sur la formule exacte"""
+
+    def __init__(self, ranges=PIVOT_TABLE_RANGES, pct_range=PIVOT_TABLE_PCT_RANGE,
+                 pct_step=PIVOT_TABLE_PCT_STEP, budget_mb=PIVOT_TABLE_BUDGET_MB, block=PIVOT_TABLE_BLOCK):
+        self.ranges = {k: ranges[d["type"]] for k, d in GEAR_DATA.items() if d["type"] in ranges}
+        self.pct_range = pct_range
+        self.pct_step = pct_step
+        self.block = block
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.nbytes = 0
+        self.blocks = OrderedDict()  # {(gear_key, pct | None, n° bloc): array('h')}
+
+    def _build_block(self, gear_key, pct, block_idx):
+        lo, hi = self.ranges[gear_key]
+        start = lo + block_idx * self.block
+        bases = range(start, min(start + self.block, hi + 1))
+        pivots, _ = calculate_pivots_batch(gear_key, bases, pct, rounded=False)
+        centi = (round(round(p, 2) * 100) for p in pivots)
+        return array("h", (c if -32767 <= c <= 32767 else _OUT_OF_RANGE for c in centi))
+
+    def _block(self, gear_key, pct, block_idx):
+        key = (gear_key, pct, block_idx)
+        block = self.blocks.get(key)
+        if block is not None:
+            self.blocks.move_to_end(key)
+            return block
+
+        block = self._build_block(gear_key, pct, block_idx)
+        size = block.itemsize * len(block)
+        if size > self.budget_bytes:
+            return None
+        while self.nbytes + size > self.budget_bytes:
+            _, evicted = self.blocks.popitem(last=False)
+            self.nbytes -= evicted.itemsize * len(evicted)
+        self.blocks[key] = block
+        self.nbytes += size
+        return block
+
+    def _grid_pct(self, pct):
+        """% SSR aligné sur la grille de la table, sinon None"""
+        lo, hi = self.pct_range
+        steps = pct / self.pct_step
+        if lo <= pct <= hi and steps == int(steps):
+            return float(pct)
+        return None
+
+    def lookup(self, gear_key, base_stat, pct_stat_ssr=None):
+        """Même résultat que calculate_pivot_7ds (ou calculate_pivot_old sans % SSR)"""
+        pct = None
+        if pct_stat_ssr is not None:
+            pct = self._grid_pct(pct_stat_ssr)
+        lo, hi = self.ranges.get(gear_key, (1, 0))
+        if (pct_stat_ssr is None or pct is not None) and lo <= base_stat <= hi and base_stat == int(base_stat):
+            block_idx, offset = divmod(int(base_stat) - lo, self.block)
+            block = self._block(gear_key, pct, block_idx)
+            if block is not None:
+                centi = block[offset]
+                # À 15.00 pile, l'arrondi peut masquer un pivot brut > 15 : on tranche avec la formule
+                if centi != _OUT_OF_RANGE and centi != MAX_SUBSTAT * 100:
+                    return {'pivot': centi / 100, 'rentable': centi < MAX_SUBSTAT * 100}
+        return self._exact(gear_key, base_stat, pct_stat_ssr)
+
+    @staticmethod
+    def _exact(gear_key, base_stat, pct_stat_ssr):
+        if pct_stat_ssr is None:
+            pivot = calculate_pivot_old(gear_key, base_stat)
+            return {'pivot': pivot, 'rentable': pivot <= MAX_SUBSTAT}
+        return calculate_pivot_7ds(gear_key, pct_stat_ssr, base_stat)
+
+    def warm(self, pcts=(None, 100.0)):
+        """Précharge les % SSR les plus demandés (à appeler au démarrage)"""
+        for gear_key, (lo, hi) in self.ranges.items():
+            for pct in pcts:
+                for block_idx in range((hi - lo) // self.block + 1):
+                    self._block(gear_key, pct, block_idx)
+
+PIVOT_TABLE = PivotTable() if PIVOT_TABLE_ENABLED else None
+
+def lookup_pivot(gear_key, base_stat, pct_stat_ssr=None):
+    """Pivot via la table précalculée si elle est active, sinon formule exacte"""
+    if PIVOT_TABLE is not None:
+        return PIVOT_TABLE.lookup(gear_key, base_stat, pct_stat_ssr)
+    return PivotTable._exact(gear_key, base_stat, pct_stat_ssr)
+
+def update_gear(gear_key, **fields):
+    """Modifie une pièce de GEAR_DATA (ex: update_gear("bague", ssr=1300)) : seul point d'écriture,
+    pour que le calcul en lot, la table de pivots et les gabarits suivent"""
+    global GEAR_KEYS, GEAR_INDEX, GEAR_SSR, GEAR_R, GEAR_DATA_VERSION, PIVOT_TABLE
+    GEAR_DATA[gear_key].update(fields)
+    GEAR_KEYS, GEAR_INDEX, GEAR_SSR, GEAR_R = _gear_columns()
+    if PIVOT_TABLE is not None:
+        PIVOT_TABLE = PivotTable()
+    GEAR_DATA_VERSION += 1
+
+# === CHANCES DE REROLL ===
+# Hypothèses par défaut, à ajuster : chaque reroll tire un nouveau % de substats (on garde le meilleur)
+ROLL_DISTRIBUTION = tuple((v / 2, 1) for v in range(1, 31))  # ((substat %, poids), ...) : uniforme de 0.5 à 15%
+ANVILS_PER_ROLL = int(os.getenv("ANVILS_PER_ROLL", "10"))
+ODDS_ROLLS = 10  # Nombre de rolls pour la probabilité affichée
+
+RollOdds = namedtuple("RollOdds", "probability expected_rolls expected_anvils")
+
+def roll_odds(pivot, current_sub, n_rolls=ODDS_ROLLS, distribution=ROLL_DISTRIBUTION, anvils_per_roll=ANVILS_PER_ROLL):
+    """Chances d'atteindre `pivot` en `n_rolls` rerolls et coût moyen en enclumes.
+
+    Les tirages étant indépendants et le meilleur étant conservé, seul compte le premier
+    tirage >= pivot (loi géométrique de paramètre p) : calcul exact, sans simulation.
+    """
+    if current_sub >= pivot:
+        return RollOdds(1.0, 0.0, 0.0)
+    total = sum(w for _, w in distribution)
+    p = sum(w for v, w in distribution if v >= pivot) / total
+    if p == 0:
+        return RollOdds(0.0, math.inf, math.inf)
+    return RollOdds(1 - (1 - p) ** n_rolls, 1 / p, anvils_per_roll / p)
+
+# === RÉPONSES AUX INTERACTIONS (defer automatique) ===
+DEFER_THRESHOLD = float(os.getenv("DEFER_THRESHOLD", "2.0"))  # Secondes depuis la réception ; Discord coupe à 3 s
+RESPONSE_PATHS = {}  # {nom: {"direct": n, "deferred": n}}
+
+class DeferGuard:
+    """Surveille une interaction : si aucune réponse n'est partie DEFER_THRESHOLD secondes après
+    sa réception, on la defer ; la réponse finale part alors en message de suivi."""
+
+    def __init__(self, interaction, name, threshold=DEFER_THRESHOLD):
+        self.interaction = interaction
+        self.name = name
+        self.threshold = threshold
+        self.lock = asyncio.Lock()  # Entre le defer automatique et reply()
+        self.deferred = False
+        self.cleared = False  # Message public du defer supprimé
+        self._task = None
+
+    def start(self):
+        elapsed = (discord.utils.utcnow() - self.interaction.created_at).total_seconds()
+        if not 0 <= elapsed < self.threshold:
+            elapsed = 0  # Horloge locale décalée : on compte à partir de maintenant
+        self._task = asyncio.get_running_loop().create_task(self._watch(self.threshold - elapsed))
+
+    async def _watch(self, delay):
+        await asyncio.sleep(delay)
+        async with self.lock:
+            if not self.interaction.response.is_done():
+                await self.interaction.response.defer(thinking=True)
+                self.deferred = True
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+def auto_defer(name):
+    """Décorateur de handler : active le DeferGuard de l'interaction pendant son exécution"""
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(*args, **kwargs):
+            interaction = next(a for a in args if isinstance(a, discord.Interaction))
+            guard = interaction.extras["defer_guard"] = DeferGuard(interaction, name)
+            guard.start()
+            try:
+                return await handler(*args, **kwargs)
+            finally:
+                guard.stop()
+        return wrapper
+    return decorator
+
+async def _send(interaction, content, **kwargs):
+    if interaction.response.is_done():
+        return await interaction.followup.send(content, **kwargs)
+    return await interaction.response.send_message(content, **kwargs)
+
+async def reply(interaction: discord.Interaction, content=None, **kwargs):
+    """Répond à l'interaction, en message de suivi si elle a déjà été deferred"""
+    guard = interaction.extras.get("defer_guard")
+    if guard is None:
+        return await _send(interaction, content, **kwargs)
+    async with guard.lock:
+        paths = RESPONSE_PATHS.setdefault(guard.name, {"direct": 0, "deferred": 0})
+        paths["deferred" if guard.deferred else "direct"] += 1
+        if guard.deferred and kwargs.get("ephemeral") and not guard.cleared:
+            # Le defer automatique est public et le 1er message de suivi le remplace en gardant sa visibilité :
+            # on retire le « réfléchit... » pour que la réponse privée parte en nouveau message
+            await interaction.delete_original_response()
+            guard.cleared = True
+        return await _send(interaction, content, **kwargs)
+
 # === MODAL /PIVOT (Retour aux stats Noir/Vert) ===
 class PivotModal(Modal):
     def __init__(self):
@@ -93,6 +564,8 @@ class PivotModal(Modal):
         self.atk_vert = TextInput(label="ATK Bonus (Vert)", placeholder="Ex: 5581", required=True)
         self.add_item(self.atk_vert)
 
+    @TELEMETRY.timed("modal:pivot")
+    @auto_defer("pivot")
     async def on_submit(self, interaction: discord.Interaction):
         try:
             log_usage(interaction, "pivot")
@@ -102,38 +575,31 @@ class PivotModal(Modal):
             base_atk = int(self.atk_noir.value.replace(" ", "")) - int(self.atk_vert.value.replace(" ", ""))
             
             if base_hp <= 0 or base_atk <= 0:
-                return await interaction.response.send_message("❌ Erreur : Stats invalides (Noir doit être > Vert)", ephemeral=True)
+                return await reply(interaction, "❌ Erreur : Stats invalides (Noir doit être > Vert)", ephemeral=True)
 
-            embed = discord.Embed(title="📊 Pivots SSR 100% vs R 15%", color=0xf39c12)
+            template = TEMPLATES.get("pivot")
+            embed = discord.Embed(title=template["title"], color=template["color"])
             embed.add_field(name="📈 Bases calculées", value=f"HP: `{base_hp:,}` • ATK: `{base_atk:,}`", inline=False)
             
-            # HP
-            hp_txt = ""
-            for k in ["ceinture", "orbe"]:
-                p = calculate_pivot_old(k, base_hp)
-                e = GEAR_DATA[k]['emoji']
-                v = "✅ Facile" if p < 10 else "⚖️ Moyen" if p < 13.5 else "⚠️ Dur"
-                hp_txt += f"{e} **{k.capitalize()}** : `{p}%` {v}\n"
-            embed.add_field(name="🔵 Pièces HP", value=hp_txt, inline=False)
+            # Toutes les pièces HP + ATK
+            keys = ("ceinture", "orbe", "bracelet", "bague")
+            bases = (base_hp, base_hp, base_atk, base_atk)
+            pivots, _ = calculate_pivots_batch(keys, bases)
+            labels = template["labels"]
+            lines = [f"{labels[k]}`{p}%` {pivot_verdict(p)}\n" for k, p in zip(keys, pivots)]
             
-            # ATK
-            atk_txt = ""
-            for k in ["bracelet", "bague"]:
-                p = calculate_pivot_old(k, base_atk)
-                e = GEAR_DATA[k]['emoji']
-                v = "✅ Facile" if p < 10 else "⚖️ Moyen" if p < 13.5 else "⚠️ Dur"
-                atk_txt += f"{e} **{k.capitalize()}** : `{p}%` {v}\n"
-            embed.add_field(name="🔴 Pièces ATK", value=atk_txt, inline=False)
+            embed.add_field(name="🔵 Pièces HP", value="".join(lines[:2]), inline=False)
+            embed.add_field(name="🔴 Pièces ATK", value="".join(lines[2:]), inline=False)
             
-            view = PivotActionView()
-            await interaction.response.send_message(embed=embed, view=view)
+            await reply(interaction, embed=embed, view=persistent_view(PivotActionView))
             
         except ValueError:
-            await interaction.response.send_message("❌ Erreur : Chiffres uniquement", ephemeral=True)
+            await reply(interaction, "❌ Erreur : Chiffres uniquement", ephemeral=True)
 
 class PivotActionView(View):
+    """Bouton de suite de /pivot (vue persistante)"""
     def __init__(self):
-        super().__init__(timeout=300)
+        super().__init__(timeout=None)
         button = Button(label="Calculer mes rolls", style=discord.ButtonStyle.primary, emoji="🎲", custom_id="goto_roll")
         button.callback = self.goto_roll
         self.add_item(button)
@@ -161,6 +627,8 @@ class RollModal(Modal):
         self.substat = TextInput(label=f"% substats actuel", placeholder="Ex: 3", required=True)
         self.add_item(self.substat)
 
+    @TELEMETRY.timed("modal:roll")
+    @auto_defer("roll")
     async def on_submit(self, interaction: discord.Interaction):
         try:
             log_usage(interaction, f"roll_{self.gear_key}")
@@ -169,114 +637,250 @@ class RollModal(Modal):
             piece_pct = float(self.piece_pct.value.replace(",", "."))
             curr_sub = float(self.substat.value.replace(",", "."))
 
-            if base <= 0: return await interaction.response.send_message("❌ Erreur stats", ephemeral=True)
+            if base <= 0: return await reply(interaction, "❌ Erreur stats", ephemeral=True)
 
-            res = calculate_pivot_7ds(self.gear_key, piece_pct, base)
+            res = lookup_pivot(self.gear_key, base, piece_pct)
             pivot = res['pivot']
+            template = TEMPLATES.get("roll")[self.gear_key]
             
             if curr_sub >= pivot:
                 msg = f"✅ **Ta pièce bat déjà la R 15% !**\nMarge : **+{round(curr_sub - pivot, 2)}%**"
                 color = 0x2ecc71
             else:
                 msg = f"🎯 **Objectif : {pivot}%**\nActuellement : **{curr_sub}%**\nReste : **+{round(pivot - curr_sub, 2)}%**"
-                color = self.gear_info['color']
-
-            embed = discord.Embed(title=f"{self.gear_info['emoji']} {self.gear_key.capitalize()}", description=msg, color=color)
+                odds = roll_odds(pivot, curr_sub)
+                if odds.probability > 0:
+                    msg += f"\n🎰 **{odds.probability:.0%}** de chances en {ODDS_ROLLS} rolls • ~**{odds.expected_anvils:,.0f}** enclumes en moyenne"
+                else:
+                    msg += "\n🎰 Objectif hors d'atteinte par reroll"
+                color = template['color']
+
+            embed = discord.Embed(title=template['title'], description=msg, color=color)
             embed.add_field(name="Base calculée", value=f"`{base:,}`", inline=True)
 
-            # Image
-            img_path = os.path.join(IMAGES_DIR, self.gear_info['image'])
-            if os.path.exists(img_path):
-                file = discord.File(img_path, filename=self.gear_info['image'])
-                embed.set_thumbnail(url=f"attachment://{self.gear_info['image']}")
-                await interaction.response.send_message(embed=embed, file=file)
+            # Image : URL CDN déjà connue, sinon pièce jointe
+            thumb_url = THUMBNAILS.get_url(self.gear_info['image'])
+            file = None if thumb_url else IMAGES.file(self.gear_info['image'])
+            if thumb_url:
+                embed.set_thumbnail(url=thumb_url)
+                await reply(interaction, embed=embed)
+            elif file is not None:
+                embed.set_thumbnail(url=template['attachment'])
+                with TELEMETRY.span("image:attach"):
+                    await reply(interaction, embed=embed, file=file)
             else:
-                await interaction.response.send_message(embed=embed)
+                await reply(interaction, embed=embed)
             
             try: await self.original_message.delete()
             except: pass
 
         except ValueError:
-            await interaction.response.send_message("❌ Erreur format", ephemeral=True)
-
-def create_roll_view():
-    class RollView(View):
-        def __init__(self):
-            super().__init__(timeout=None)
-            for i, (k, d) in enumerate(GEAR_DATA.items()):
-                b = Button(label=k.capitalize(), style=discord.ButtonStyle.primary if d['type']=='HP' else discord.ButtonStyle.danger, emoji=d['emoji'], row=i//2)
-                async def cb(intr, key=k): await intr.response.send_modal(RollModal(key, intr.message))
-                b.callback = cb
-                self.add_item(b)
-    return RollView
+            await reply(interaction, "❌ Erreur format", ephemeral=True)
+
+class RollView(View):
+    """Choix de la pièce pour /roll (vue persistante : custom_id `roll:<pièce>`)"""
+    def __init__(self):
+        super().__init__(timeout=None)
+        for i, (k, d) in enumerate(GEAR_DATA.items()):
+            b = Button(label=k.capitalize(), style=discord.ButtonStyle.primary if d['type']=='HP' else discord.ButtonStyle.danger, emoji=d['emoji'], row=i//2, custom_id=f"roll:{k}")
+            b.callback = self.choose_gear
+            self.add_item(b)
+
+    async def choose_gear(self, interaction: discord.Interaction):
+        key = interaction.data["custom_id"].split(":", 1)[1]
+        await interaction.response.send_modal(RollModal(key, interaction.message))
+
+# === VUES PERSISTANTES ===
+# Pour chaque vue, une instance enregistrée via client.add_view traite les clics de TOUS les messages
+# (custom_id fixes, fonctionne aussi après un redémarrage). Une seconde instance, arrêtée, sert de
+# gabarit d'envoi : discord.py ne garde pas en mémoire les vues arrêtées, donc rien ne s'accumule par message.
+PERSISTENT_VIEWS = {}  # {classe: vue arrêtée à envoyer}
+
+def register_persistent_views():
+    """À appeler une fois, sur la boucle du bot (les View ont besoin d'une boucle active)"""
+    for view_cls in (RollView, PivotActionView):
+        client.add_view(view_cls())
+        template = view_cls()
+        template.stop()
+        PERSISTENT_VIEWS[view_cls] = template
+
+def persistent_view(view_cls):
+    return PERSISTENT_VIEWS[view_cls]
+
+# === RÉPONSES PRÉCONSTRUITES ===
+class ResponseTemplates:
+    """Réponses (embeds, vues, libellés) construites une fois puis réutilisées telles quelles.
+
+    Chaque gabarit a une fonction `version` : si elle renvoie autre chose qu'à la
+    construction (texte ou données modifiés), le gabarit est reconstruit au get() suivant.
+    Les vues des gabarits sont arrêtées, comme celles de PERSISTENT_VIEWS : rien n'est gardé par message.
+    """
+
+    def __init__(self):
+        self._builders = {}  # {nom: (build, version)}
+        self._cache = {}     # {nom: (version, gabarit)}
+
+    def register(self, name, version=lambda: None):
+        def decorator(build):
+            self._builders[name] = (build, version)
+            return build
+        return decorator
+
+    def get(self, name):
+        build, version = self._builders[name]
+        current = version()
+        cached = self._cache.get(name)
+        if cached is None or cached[0] != current:
+            cached = self._cache[name] = (current, build())
+        return cached[1]
+
+    def invalidate(self, name=None):
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(name, None)
+
+    def warm(self):
+        """Construit tous les gabarits (sur la boucle du bot : certains contiennent des View)"""
+        for name in self._builders:
+            self.get(name)
+
+TEMPLATES = ResponseTemplates()
+
+def gear_label(gear_key):
+    return f"{GEAR_DATA[gear_key]['emoji']} **{gear_key.capitalize()}**"
+
+@TEMPLATES.register("pivot", version=lambda: GEAR_DATA_VERSION)
+def build_pivot_template():
+    """Parties fixes de l'embed /pivot : seuls les chiffres sont ajoutés à chaque appel"""
+    return {
+        "title": "📊 Pivots SSR 100% vs R 15%",
+        "color": 0xf39c12,
+        "labels": {k: f"{gear_label(k)} : " for k in GEAR_DATA},
+    }
+
+@TEMPLATES.register("roll", version=lambda: GEAR_DATA_VERSION)
+def build_roll_template():
+    """Titre, couleur et miniature en pièce jointe de l'embed /roll, par pièce"""
+    return {
+        k: {"title": f"{d['emoji']} {k.capitalize()}", "color": d["color"], "attachment": f"attachment://{d['image']}"}
+        for k, d in GEAR_DATA.items()
+    }
+
+@TEMPLATES.register("gear_labels", version=lambda: GEAR_DATA_VERSION)
+def build_gear_labels():
+    return {k: gear_label(k) for k in GEAR_DATA}
 
 @tree.command(name="pivot", description="📊 Calcule pivots (Noir/Vert)")
+@TELEMETRY.timed("/pivot")
 async def pivot_command(interaction: discord.Interaction):
     await interaction.response.send_modal(PivotModal())
 
 @tree.command(name="roll", description="🎲 Vérifie rolls")
+@TELEMETRY.timed("/roll")
 async def roll_command(interaction: discord.Interaction):
-    view = create_roll_view()()
-    await interaction.response.send_message(embed=discord.Embed(title="Choisis une pièce", color=0x9b59b6), view=view)
-
-@tree.command(name="farm", description="💸 Rentabilité Gold vs Enclumes (Podium)")
-async def farm_command(interaction: discord.Interaction):
+    await interaction.response.send_message(embed=discord.Embed(title="Choisis une pièce", color=0x9b59b6), view=persistent_view(RollView))
+
+def parse_slot(value):
+    """"% pièce/% substats" (ex: "100/3" ou "95,5/12,5") -> (pct, substat)"""
+    pct, _, sub = value.partition("/")
+    return float(pct.replace(",", ".").strip()), float((sub.strip() or "0").replace(",", "."))
+
+@tree.command(name="stuff", description="🧮 Analyse tes 6 pièces en une fois")
+@app_commands.describe(
+    hp_noir="HP Total (Noir)", hp_vert="HP Bonus (Vert)",
+    atk_noir="ATK Total (Noir)", atk_vert="ATK Bonus (Vert)",
+    def_noir="DEF Total (Noir)", def_vert="DEF Bonus (Vert)",
+    ceinture="% pièce SSR / % substats (ex: 100/3)", orbe="% pièce SSR / % substats (ex: 100/3)",
+    bracelet="% pièce SSR / % substats (ex: 100/3)", bague="% pièce SSR / % substats (ex: 100/3)",
+    collier="% pièce SSR / % substats (ex: 100/3)", boucles="% pièce SSR / % substats (ex: 100/3)",
+)
+@TELEMETRY.timed("/stuff")
+@auto_defer("stuff")
+async def stuff_command(
+    interaction: discord.Interaction,
+    hp_noir: int, hp_vert: int, atk_noir: int, atk_vert: int, def_noir: int, def_vert: int,
+    ceinture: str = "100/0", orbe: str = "100/0", bracelet: str = "100/0",
+    bague: str = "100/0", collier: str = "100/0", boucles: str = "100/0",
+):
+    log_usage(interaction, "stuff")
+    bases = {"HP": hp_noir - hp_vert, "ATK": atk_noir - atk_vert, "DEF": def_noir - def_vert}
+    if min(bases.values()) <= 0:
+        return await reply(interaction, "❌ Erreur : Stats invalides (Noir doit être > Vert)", ephemeral=True)
+    try:
+        slots = {k: parse_slot(v) for k, v in zip(GEAR_DATA, (ceinture, orbe, bracelet, bague, collier, boucles))}
+    except ValueError:
+        return await reply(interaction, "❌ Erreur format (ex: `100/3`)", ephemeral=True)
+
+    embed = discord.Embed(title="🧮 Analyse du stuff", color=0x9b59b6)
+    embed.add_field(name="📈 Bases calculées", value=f"HP: `{bases['HP']:,}` • ATK: `{bases['ATK']:,}` • DEF: `{bases['DEF']:,}`", inline=False)
+    labels = TEMPLATES.get("gear_labels")
+    lines = []
+    for rank, res in enumerate(evaluate_loadout(bases, slots), 1):
+        if not res["rentable"]:
+            # Les substats plafonnent à MAX_SUBSTAT : aucun reroll ne rattrape la R
+            lines.append(f"➖ {labels[res['gear']]} : ⛔ Hors d'atteinte (objectif `{res['pivot']}%`) • garde ta R")
+            continue
+        if res["missing"] > 0:
+            status = f"🎯 Reste **+{res['missing']}%** (objectif `{res['pivot']}%`, actuel `{res['current']}%`)"
+        else:
+            status = f"✅ Bat la R 15% (marge **+{-res['missing']}%**)"
+        lines.append(f"**{rank}.** {labels[res['gear']]} : {status}")
+    embed.add_field(name="🏁 Priorités de roll", value="\n".join(lines), inline=False)
+    embed.set_footer(text="Classement : la pièce la plus loin de battre une R 15% en premier")
+    await reply(interaction, embed=embed)
+
+FARMING_PAGE_URL = "https://sevends-stuff.onrender.com/farming"
+FARM_PLACES = (("👑 N°1", "📈", "✨"), ("🥈 N°2", "📉", "⚠️"), ("🥉 N°3", "⛔", "❌"))
+
+def farm_embed(results, scenario):
+    """Podium /farm à partir d'un classement de farm_model"""
+    hours = f"{scenario.hours:g}"
     embed = discord.Embed(
         title="🏆 Rentabilité Farming Enclumes", 
-        description="Comparatif sur **8 heures** de farm (Full Stamina)",
+        description=f"Comparatif sur **{hours} heures** de farm (Full Stamina)",
         color=0x00dbde
     )
-    
-    # 1. LE VAINQUEUR (BdG Half)
-    embed.add_field(
-        name="👑 N°1 : BdG (Half-Stam)", 
-        value=(
-            "**0,054** Enclume/Stam\n"
-            "📈 **915 Enclumes** / 8h\n"
-            "✨ *Le ROI absolu. 3x plus rentable.*"
-        ), 
-        inline=False
-    )
-    
-    # 2. LE DEUXIÈME (BdG Normal)
-    embed.add_field(
-        name="🥈 N°2 : BdG (70 Stam)", 
-        value=(
-            "**0,027** Enclume/Stam\n"
-            "📉 **~460 Enclumes** / 8h\n"
-            "⚠️ *Coûteux en potions.*"
-        ), 
-        inline=True
-    )
-    
-    # 3. LE PERDANT (Donjon Or)
-    embed.add_field(
-        name="🥉 N°3 : Donjon Or", 
-        value=(
-            "**0,020** Enclume/Stam\n"
-            "⛔ **240 Enclumes** / 8h\n"
-            "❌ *À éviter pour les enclumes.*"
-        ), 
-        inline=True
-    )
+    best, worst = results[0], results[-1]
+    for i, (res, (place, trend, mark)) in enumerate(zip(results, FARM_PLACES)):
+        note = f"Le ROI absolu. {best.anvils_per_stamina / worst.anvils_per_stamina:.0f}x plus rentable." if i == 0 else res.stage.note
+        value = f"**{farm_model.format_ratio(res.anvils_per_stamina)}** Enclume/Stam\n{trend} **{farm_model.format_count(res.anvils)} Enclumes** / {hours}h"
+        if note:
+            value += f"\n{mark} *{note}*"
+        embed.add_field(name=f"{place} : {res.stage.name}", value=value, inline=i > 0)
     
     # Footer technique
-    embed.set_footer(text="Base : 1 Tirage = 0,66 Enclume • 1 Tirage = 200k Gold")
-    
+    draw = f"{scenario.anvils_per_draw:g}".replace(".", ",")
+    embed.set_footer(text=f"Base : 1 Tirage = {draw} Enclume • 1 Tirage = {scenario.gold_per_draw // 1000}k Gold")
+    return embed
+
+@TEMPLATES.register("farm", version=lambda: farm_model.VERSION)
+def build_farm_template():
+    """Embed + bouton de /farm pour le scénario par défaut, reconstruits quand les données de farm changent"""
     # Bouton vers le site (le Podium visuel)
-    view = View()
-    # ATTENTION : Remplace l'URL ci-dessous par la VRAIE URL de ton bot Render
-    btn = Button(label="Voir le Graphique 📊", style=discord.ButtonStyle.link, url="https://sevends-stuff.onrender.com/farming")
-    view.add_item(btn)
-    
-    await interaction.response.send_message(embed=embed, view=view)
+    view = View(timeout=None)
+    view.add_item(Button(label="Voir le Graphique 📊", style=discord.ButtonStyle.link, url=FARMING_PAGE_URL))
+    view.stop()
+    return {"embed": farm_embed(farm_model.rank(), farm_model.DEFAULT_SCENARIO), "view": view}
 
+@tree.command(name="farm", description="💸 Rentabilité Gold vs Enclumes (Podium)")
+@app_commands.describe(heures="Durée de la session de farm (8 h par défaut)")
+@TELEMETRY.timed("/farm")
+@auto_defer("farm")
+async def farm_command(interaction: discord.Interaction, heures: app_commands.Range[float, 0.5, 72.0] = None):
+    template = TEMPLATES.get("farm")
+    if heures is None or heures == farm_model.DEFAULT_SCENARIO.hours:
+        return await reply(interaction, **template)
+    scenario = replace(farm_model.DEFAULT_SCENARIO, hours=heures)
+    await reply(interaction, embed=farm_embed(farm_model.rank(scenario), scenario), view=template["view"])
 
 
-@tree.command(name="help", description="❓ Comment utiliser le bot")
-async def help_command(interaction: discord.Interaction):
-    log_usage(interaction, "help")
-    
+
+HELP_VERSION = "2.0"
+
+@TEMPLATES.register("help", version=lambda: HELP_VERSION)
+def build_help_template():
+    """Embed de /help, reconstruit quand HELP_VERSION change"""
     embed = discord.Embed(title="📖 Guide du Lampa Calculator", color=0x3498db)
     
     embed.add_field(
@@ -301,25 +905,459 @@ async def help_command(interaction: discord.Interaction):
         inline=False
     )
     
-    embed.set_footer(text="Dev by Lampa • Version 2.0")
-    await interaction.response.send_message(embed=embed)
+    embed.add_field(
+        name="🧮 /stuff", 
+        value=(
+            "Analyse tes 6 pièces d'un coup et les classe par priorité de roll.\n"
+            "• Rentre les stats Noir/Vert HP, ATK et DEF.\n"
+            "• Pour chaque pièce : `% pièce/% substats` (ex: `95/12.5`)."
+        ), 
+        inline=False
+    )
+    
+    embed.set_footer(text=f"Dev by Lampa • Version {HELP_VERSION}")
+    return {"embed": embed}
 
+@tree.command(name="help", description="❓ Comment utiliser le bot")
+@TELEMETRY.timed("/help")
+@auto_defer("help")
+async def help_command(interaction: discord.Interaction):
+    log_usage(interaction, "help")
+    await reply(interaction, **TEMPLATES.get("help"))
+
+
+# === SYNCHRO DES COMMANDES ===
+DEV_GUILD_ID = int(os.getenv("DEV_GUILD_ID", "0"))  # Serveur de test : synchro instantanée au lieu de globale
+COMMAND_HASH_FILE = os.getenv("COMMAND_HASH_FILE", os.path.join(BASE_DIR, ".command_hashes.json"))
+
+def command_schema_hash():
+    """Empreinte stable des définitions de commandes (noms, descriptions, options)"""
+    payload = sorted((cmd.to_dict() for cmd in tree.get_commands()), key=lambda c: c["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+async def sync_commands(force=False):
+    """Synchronise les commandes seulement si leur définition a changé depuis la dernière synchro"""
+    guild = discord.Object(id=DEV_GUILD_ID) if DEV_GUILD_ID else None
+    scope = f"guild:{DEV_GUILD_ID}" if guild else "global"
+    if guild:
+        tree.copy_global_to(guild=guild)
+
+    digest = command_schema_hash()
+    try:
+        with open(COMMAND_HASH_FILE, encoding="utf-8") as f:
+            hashes = json.load(f)
+    except (FileNotFoundError, ValueError):
+        hashes = {}
+    if not force and hashes.get(scope) == digest:
+        print(f"⏭️ Commandes inchangées ({scope}) : pas de synchro")
+        return False
+
+    try:
+        with TELEMETRY.span("tree.sync"):
+            await tree.sync(guild=guild)
+    except discord.HTTPException as e:
+        # Pas d'empreinte enregistrée : nouvel essai au prochain démarrage
+        print(f"⚠️ Synchro des commandes échouée ({scope}) : {e}")
+        return False
+    hashes[scope] = digest
+    with open(COMMAND_HASH_FILE, "w", encoding="utf-8") as f:
+        json.dump(hashes, f)
+    print(f"🔄 Commandes synchronisées ({scope})")
+    return True
 
 @client.event
 async def on_ready():
-    await tree.sync()
+    THUMBNAILS.warm()
     print(f'✅ Bot connecté : {client.user}')
 
 # === WEB SERVER PREMIUM DESIGN ===
 app = Flask(__name__)
 
+# --- COMPRESSION HTTP ---
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))  # Octets, en dessous on n'encode pas
+COMPRESS_LEVEL_RANGES = {"br": (0, 11), "gzip": (1, 9)}
+# Pages dynamiques : un seul réglage, ramené à la plage valide de chaque encodage (11 -> gzip 9)
+COMPRESS_LEVEL = {
+    encoding: min(max(int(os.getenv("COMPRESS_LEVEL", "6")), low), high)
+    for encoding, (low, high) in COMPRESS_LEVEL_RANGES.items()
+}
+STATIC_COMPRESS_LEVEL = {"br": 11, "gzip": 9}  # Pages statiques : compressées une seule fois, au max
+COMPRESSIBLE_TYPES = ("text/html", "text/css", "text/plain", "application/json")
+
+def compress(data, encoding, level):
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+# Encodages disponibles, par ordre de préférence
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+def choose_encoding(accept_encoding, available=ENCODINGS):
+    """Meilleur encodage de `available` accepté par le client (en-tête Accept-Encoding), sinon identity"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in ENCODINGS:
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return "identity"
+
+def compress_dynamic(data, accept_encoding):
+    """(data, encoding) : compresse une réponse dynamique si elle est assez grosse et que le client l'accepte"""
+    if len(data) < COMPRESS_MIN_SIZE:
+        return data, "identity"
+    encoding = choose_encoding(accept_encoding)
+    if encoding == "identity":
+        return data, encoding
+    return compress(data, encoding, COMPRESS_LEVEL[encoding]), encoding
+
+# --- TEMPS DE RÉPONSE DES ROUTES ---
+@app.before_request
+def start_route_span():
+    g.route_span = TELEMETRY.begin()
+
+@app.after_request
+def end_route_span(response):
+    """Enregistré avant compress_response, donc exécuté après : la compression est comptée"""
+    if request.endpoint is not None:
+        TELEMETRY.end(f"web:{request.endpoint}", g.pop("route_span", None))
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Compresse à la volée les réponses dynamiques (les réponses en cache ont déjà leurs variantes)"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers or "ETag" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add("Accept-Encoding")
+    data, encoding = compress_dynamic(data, request.headers.get("Accept-Encoding"))
+    if encoding != "identity":
+        response.set_data(data)
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+# --- CACHE HTTP (pages statiques & assets) ---
+PAGE_MAX_AGE = int(os.getenv("PAGE_MAX_AGE", "3600"))
+ASSET_MAX_AGE = 31536000  # Les URLs d'assets contiennent leur empreinte : cache "à vie"
+
+class CachedResponse:
+    """Réponse calculée une seule fois : corps en bytes + ETag fort, et variantes précompressées"""
+
+    def __init__(self, body, content_type, max_age, immutable=False):
+        self.body = body.encode("utf-8") if isinstance(body, str) else body
+        self.content_type = content_type
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.cache_control = f"public, max-age={max_age}" + (", immutable" if immutable else "")
+        # {encoding: (body, etag)} ; chaque variante a son propre ETag fort
+        self.variants = {"identity": (self.body, self.etag)}
+        if len(self.body) >= COMPRESS_MIN_SIZE:
+            for encoding in ENCODINGS:
+                data = compress(self.body, encoding, STATIC_COMPRESS_LEVEL[encoding])
+                if len(data) < len(self.body):
+                    self.variants[encoding] = (data, f'"{digest}-{encoding}"')
+
+    def respond(self, if_none_match=None, accept_encoding=None):
+        """(status, headers, body) selon les en-têtes If-None-Match et Accept-Encoding du client"""
+        encoding = choose_encoding(accept_encoding, self.variants)
+        body, etag = self.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            if "*" in tags or etag in tags or f"W/{etag}" in tags:
+                return 304, headers, b""
+        headers["Content-Type"] = self.content_type
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return 200, headers, body
+
+def send_cached(cached):
+    """Réponse Flask (200 ou 304) pour une CachedResponse"""
+    status, headers, body = cached.respond(request.headers.get("If-None-Match"), request.headers.get("Accept-Encoding"))
+    return Response(body, status=status, headers=headers)
+
+def cached_page(render=None, *, version=lambda: None):
+    """Décorateur de route : la page est rendue au premier appel puis servie depuis le cache,
+    et de nouveau rendue quand `version()` change (données sous-jacentes modifiées)"""
+    if render is None:
+        return partial(cached_page, version=version)
+    cache = {}
+
+    def get_cached():
+        current = version()
+        cached = cache.get("page")
+        if cached is None or cached[0] != current:
+            cached = cache["page"] = (current, CachedResponse(render(), "text/html; charset=utf-8", PAGE_MAX_AGE))
+        return cached[1]
+
+    @wraps(render)
+    def view():
+        return send_cached(get_cached())
+
+    view.get_cached = get_cached
+    view.invalidate = cache.clear
+    return view
+
+# --- ASSETS CSS (servis à part pour être mis en cache par le navigateur) ---
+LAYOUT_CSS = """
+:root {
+    --glass-bg: rgba(255, 255, 255, 0.05);
+    --glass-border: rgba(255, 255, 255, 0.1);
+    --text-glow: 0 0 10px rgba(118, 75, 162, 0.5);
+    --primary-gradient: linear-gradient(45deg, #00dbde, #fc00ff);
+}
+
+body {
+    margin: 0;
+    padding: 0;
+    font-family: 'Inter', 'Segoe UI', sans-serif;
+    background: #0f0c29;  /* fallback */
+    background: linear-gradient(to bottom right, #24243e, #302b63, #0f0c29);
+    color: white;
+    min-height: 100vh;
+    overflow-x: hidden;
+}
+
+/* BACKGROUND ANIMÉ */
+body::before {
+    content: '';
+    position: fixed;
+    top: -50%;
+    left: -50%;
+    width: 200%;
+    height: 200%;
+    background: radial-gradient(circle, rgba(118,75,162,0.15) 0%, transparent 60%),
+                radial-gradient(circle, rgba(0,219,222,0.1) 0%, transparent 50%);
+    z-index: -1;
+    animation: float 20s infinite linear;
+}
+
+@keyframes float { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
+
+/* NAVBAR */
+.navbar {
+    display: flex;
+    justify-content: center;
+    padding: 20px;
+    backdrop-filter: blur(10px);
+    position: sticky;
+    top: 0;
+    z-index: 100;
+    border-bottom: 1px solid var(--glass-border);
+    background: rgba(15, 12, 41, 0.7);
+}
+
+.nav-item {
+    color: rgba(255,255,255,0.6);
+    text-decoration: none;
+    margin: 0 20px;
+    font-weight: 500;
+    transition: 0.3s;
+    position: relative;
+    padding: 5px 0;
+}
+
+.nav-item:hover, .nav-item.active {
+    color: white;
+    text-shadow: var(--text-glow);
+}
+
+.nav-item.active::after {
+    content: '';
+    position: absolute;
+    bottom: -5px;
+    left: 0;
+    width: 100%;
+    height: 2px;
+    background: var(--primary-gradient);
+    box-shadow: 0 0 10px #fc00ff;
+}
+
+/* CONTENEUR */
+.container {
+    max-width: 1000px;
+    margin: 40px auto;
+    padding: 20px;
+}
+
+/* EFFET GLASS (La Vitre) */
+.glass-card {
+    background: var(--glass-bg);
+    backdrop-filter: blur(12px);
+    -webkit-backdrop-filter: blur(12px);
+    border: 1px solid var(--glass-border);
+    border-radius: 20px;
+    padding: 30px;
+    box-shadow: 0 8px 32px 0 rgba(0, 0, 0, 0.37);
+    margin-bottom: 30px;
+    transition: transform 0.3s ease;
+}
+
+.glass-card:hover {
+    border-color: rgba(255,255,255,0.2);
+}
+
+/* TEXTE LIQUIDE */
+.liquid-text {
+    background: var(--primary-gradient);
+    background-size: 200% auto;
+    color: #000;
+    -webkit-background-clip: text;
+    -webkit-text-fill-color: transparent;
+    animation: shine 3s linear infinite;
+    font-weight: 800;
+}
+
+@keyframes shine { to { background-position: 200% center; } }
+
+/* BOUTON STATUS PULSE */
+.status-badge {
+    display: inline-flex;
+    align-items: center;
+    padding: 8px 16px;
+    background: rgba(46, 204, 113, 0.1);
+    border: 1px solid #2ecc71;
+    border-radius: 50px;
+    color: #2ecc71;
+    font-weight: bold;
+    box-shadow: 0 0 15px rgba(46, 204, 113, 0.2);
+}
+
+.dot {
+    width: 10px;
+    height: 10px;
+    background: #2ecc71;
+    border-radius: 50%;
+    margin-right: 10px;
+    animation: pulse 2s infinite;
+}
+
+@keyframes pulse {
+    0% { box-shadow: 0 0 0 0 rgba(46, 204, 113, 0.7); }
+    70% { box-shadow: 0 0 0 10px rgba(46, 204, 113, 0); }
+    100% { box-shadow: 0 0 0 0 rgba(46, 204, 113, 0); }
+}
+
+/* TABLES */
+table { width: 100%; border-collapse: collapse; margin-top: 10px; }
+th { text-align: left; color: #a0a0a0; padding: 10px; border-bottom: 1px solid var(--glass-border); }
+td { padding: 15px 10px; border-bottom: 1px solid rgba(255,255,255,0.05); }
+
+/* GRID ACCUEIL */
+.grid-3 { display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 20px; }
+.feature-icon { font-size: 2em; margin-bottom: 10px; display: block; }
+"""
+
+# Style spécifique au podium de /farming
+FARMING_CSS = """
+.podium-container {
+    display: flex;
+    align-items: flex-end;
+    justify-content: center;
+    gap: 20px;
+    margin-top: 20px;
+    height: 400px;
+}
+
+.podium-step {
+    background: rgba(255, 255, 255, 0.05);
+    backdrop-filter: blur(10px);
+    border: 1px solid rgba(255, 255, 255, 0.1);
+    border-radius: 15px 15px 0 0;
+    text-align: center;
+    padding: 20px;
+    position: relative;
+    transition: transform 0.3s ease;
+}
+
+.podium-step:hover { transform: translateY(-5px); }
+
+/* HAUTEURS */
+.step-1 { height: 100%; width: 35%; border-top: 2px solid #00dbde; background: linear-gradient(to bottom, rgba(0, 219, 222, 0.1), rgba(255,255,255,0.02)); z-index: 2; box-shadow: 0 0 30px rgba(0, 219, 222, 0.15); }
+.step-2 { height: 75%; width: 30%; border-top: 2px solid #f39c12; }
+.step-3 { height: 60%; width: 30%; border-top: 2px solid #e74c3c; }
+
+/* MEDAILLES */
+.medal {
+    width: 40px; height: 40px; line-height: 40px; border-radius: 50%;
+    font-weight: bold; font-size: 1.2em; margin: 0 auto 10px auto;
+    box-shadow: 0 4px 10px rgba(0,0,0,0.3);
+}
+.gold { background: linear-gradient(45deg, #ffd700, #fdb931); color: #000; }
+.silver { background: linear-gradient(45deg, #e0e0e0, #bdbdbd); color: #000; }
+.bronze { background: linear-gradient(45deg, #cd7f32, #a0522d); color: #fff; }
+
+.crown { font-size: 2em; margin-bottom: -10px; animation: float 3s infinite ease-in-out; }
+
+/* TEXTES */
+h3 { font-size: 1.1em; margin: 10px 0; color: #fff; }
+.stat-box { background: rgba(0,0,0,0.3); padding: 10px; border-radius: 8px; margin: 15px 0; }
+.winner-box { background: rgba(0, 219, 222, 0.1); border: 1px solid rgba(0, 219, 222, 0.3); }
+
+.value { display: block; font-size: 1.8em; font-weight: bold; }
+.step-1 .value { color: #00dbde; }
+.step-2 .value { color: #f39c12; }
+.step-3 .value { color: #e74c3c; }
+
+.label { font-size: 0.7em; text-transform: uppercase; letter-spacing: 1px; color: #aaa; }
+
+.badge-winner {
+    background: linear-gradient(90deg, #00dbde, #fc00ff);
+    color: #000; font-weight: bold; font-size: 0.8em;
+    padding: 5px 10px; border-radius: 20px; display: inline-block; margin-bottom: 10px;
+}
+
+.gain { font-size: 1.2em; font-weight: bold; color: #fff; }
+.gain-winner { font-size: 1.5em; text-shadow: 0 0 10px rgba(255,255,255,0.5); }
+.sub-gain { font-size: 0.8em; color: #00dbde; }
+
+/* GRAPHIQUE BARRES */
+.chart-row { display: flex; align-items: center; margin-bottom: 15px; }
+.chart-label { width: 100px; font-size: 0.9em; color: #ccc; }
+.chart-bar { 
+    height: 30px; line-height: 30px; 
+    border-radius: 0 15px 15px 0; padding-left: 10px; 
+    color: #fff; font-weight: bold; font-size: 0.9em; text-shadow: 1px 1px 2px rgba(0,0,0,0.5);
+    transition: width 1s ease-out;
+}
+"""
+
+ASSETS = {
+    "style.css": CachedResponse(LAYOUT_CSS, "text/css; charset=utf-8", ASSET_MAX_AGE, immutable=True),
+    "farming.css": CachedResponse(FARMING_CSS, "text/css; charset=utf-8", ASSET_MAX_AGE, immutable=True),
+}
+
+def asset_url(name):
+    """URL versionnée d'un asset (change dès que son contenu change)"""
+    return f"/assets/{name}?v={ASSETS[name].etag[1:13]}"
+
+@app.route('/assets/<name>')
+def asset(name):
+    cached = ASSETS.get(name)
+    if cached is None:
+        abort(404)
+    return send_cached(cached)
+
 # --- LAYOUT GÉNÉRAL (CSS & SQUELETTE) ---
-def get_layout(content, title="Lampa Calculator", active_page="/"):
+def get_layout(content, title="Lampa Calculator", active_page="/", stylesheets=()):
     nav_items = {
         "/": "🏠 Accueil",
         "/guide": "📖 Commandes & Guide",
         "/farming": "💸 Farming",
-        "/stats": "📊 Statistiques"
+        "/stats": "📊 Statistiques",
+        "/perf": "⏱️ Performances"
     }
     
     nav_html = ""
@@ -327,6 +1365,8 @@ def get_layout(content, title="Lampa Calculator", active_page="/"):
         active_class = 'active' if link == active_page else ''
         nav_html += f'<a href="{link}" class="nav-item {active_class}">{name}</a>'
 
+    extra_head = "".join(f'<link rel="stylesheet" href="{asset_url(name)}">' for name in stylesheets)
+
     return f'''
     <!DOCTYPE html>
     <html lang="fr">
@@ -334,155 +1374,8 @@ def get_layout(content, title="Lampa Calculator", active_page="/"):
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <title>{title}</title>
-        <style>
-            :root {{
-                --glass-bg: rgba(255, 255, 255, 0.05);
-                --glass-border: rgba(255, 255, 255, 0.1);
-                --text-glow: 0 0 10px rgba(118, 75, 162, 0.5);
-                --primary-gradient: linear-gradient(45deg, #00dbde, #fc00ff);
-            }}
-
-            body {{
-                margin: 0;
-                padding: 0;
-                font-family: 'Inter', 'Segoe UI', sans-serif;
-                background: #0f0c29;  /* fallback */
-                background: linear-gradient(to bottom right, #24243e, #302b63, #0f0c29);
-                color: white;
-                min-height: 100vh;
-                overflow-x: hidden;
-            }}
-
-            /* BACKGROUND ANIMÉ */
-            body::before {{
-                content: '';
-                position: fixed;
-                top: -50%;
-                left: -50%;
-                width: 200%;
-                height: 200%;
-                background: radial-gradient(circle, rgba(118,75,162,0.15) 0%, transparent 60%),
-                            radial-gradient(circle, rgba(0,219,222,0.1) 0%, transparent 50%);
-                z-index: -1;
-                animation: float 20s infinite linear;
-            }}
-            
-            @keyframes float {{ 0% {{ transform: rotate(0deg); }} 100% {{ transform: rotate(360deg); }} }}
-
-            /* NAVBAR */
-            .navbar {{
-                display: flex;
-                justify-content: center;
-                padding: 20px;
-                backdrop-filter: blur(10px);
-                position: sticky;
-                top: 0;
-                z-index: 100;
-                border-bottom: 1px solid var(--glass-border);
-                background: rgba(15, 12, 41, 0.7);
-            }}
-
-            .nav-item {{
-                color: rgba(255,255,255,0.6);
-                text-decoration: none;
-                margin: 0 20px;
-                font-weight: 500;
-                transition: 0.3s;
-                position: relative;
-                padding: 5px 0;
-            }}
-
-            .nav-item:hover, .nav-item.active {{
-                color: white;
-                text-shadow: var(--text-glow);
-            }}
-            
-            .nav-item.active::after {{
-                content: '';
-                position: absolute;
-                bottom: -5px;
-                left: 0;
-                width: 100%;
-                height: 2px;
-                background: var(--primary-gradient);
-                box-shadow: 0 0 10px #fc00ff;
-            }}
-
-            /* CONTENEUR */
-            .container {{
-                max-width: 1000px;
-                margin: 40px auto;
-                padding: 20px;
-            }}
-
-            /* EFFET GLASS (La Vitre) */
-            .glass-card {{
-                background: var(--glass-bg);
-                backdrop-filter: blur(12px);
-                -webkit-backdrop-filter: blur(12px);
-                border: 1px solid var(--glass-border);
-                border-radius: 20px;
-                padding: 30px;
-                box-shadow: 0 8px 32px 0 rgba(0, 0, 0, 0.37);
-                margin-bottom: 30px;
-                transition: transform 0.3s ease;
-            }}
-            
-            .glass-card:hover {{
-                border-color: rgba(255,255,255,0.2);
-            }}
-
-            /* TEXTE LIQUIDE */
-            .liquid-text {{
-                background: var(--primary-gradient);
-                background-size: 200% auto;
-                color: #000;
-                -webkit-background-clip: text;
-                -webkit-text-fill-color: transparent;
-                animation: shine 3s linear infinite;
-                font-weight: 800;
-            }}
-
-            @keyframes shine {{ to {{ background-position: 200% center; }} }}
-
-            /* BOUTON STATUS PULSE */
-            .status-badge {{
-                display: inline-flex;
-                align-items: center;
-                padding: 8px 16px;
-                background: rgba(46, 204, 113, 0.1);
-                border: 1px solid #2ecc71;
-                border-radius: 50px;
-                color: #2ecc71;
-                font-weight: bold;
-                box-shadow: 0 0 15px rgba(46, 204, 113, 0.2);
-            }}
-
-            .dot {{
-                width: 10px;
-                height: 10px;
-                background: #2ecc71;
-                border-radius: 50%;
-                margin-right: 10px;
-                animation: pulse 2s infinite;
-            }}
-
-            @keyframes pulse {{
-                0% {{ box-shadow: 0 0 0 0 rgba(46, 204, 113, 0.7); }}
-                70% {{ box-shadow: 0 0 0 10px rgba(46, 204, 113, 0); }}
-                100% {{ box-shadow: 0 0 0 0 rgba(46, 204, 113, 0); }}
-            }}
-
-            /* TABLES */
-            table {{ width: 100%; border-collapse: collapse; margin-top: 10px; }}
-            th {{ text-align: left; color: #a0a0a0; padding: 10px; border-bottom: 1px solid var(--glass-border); }}
-            td {{ padding: 15px 10px; border-bottom: 1px solid rgba(255,255,255,0.05); }}
-            
-            /* GRID ACCUEIL */
-            .grid-3 {{ display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 20px; }}
-            .feature-icon {{ font-size: 2em; margin-bottom: 10px; display: block; }}
-
-        </style>
+        <link rel="stylesheet" href="{asset_url('style.css')}">
+        {extra_head}
     </head>
     <body>
         <nav class="navbar">
@@ -497,6 +1390,7 @@ def get_layout(content, title="Lampa Calculator", active_page="/"):
 
 # --- PAGE 1 : VITRINE (ACCUEIL) ---
 @app.route('/')
+@cached_page
 def home():
     content = f'''
         <div style="text-align: center; margin-bottom: 60px;">
@@ -532,10 +1426,11 @@ def home():
             <p style="color: #aaa;">Utilisez les commandes slash <code>/</code> sur votre serveur.</p>
         </div>
     '''
-    return render_template_string(get_layout(content, "Lampa - Accueil", "/"))
+    return get_layout(content, "Lampa - Accueil", "/")
 
 # --- PAGE 2 : GUIDE & COMMANDES ---
 @app.route('/guide')
+@cached_page
 def guide():
     content = '''
         <h1 class="liquid-text">Commandes & Guide</h1>
@@ -561,27 +1456,100 @@ def guide():
             <p style="color: #aaa;">Pour les pièces HP (Ceinture/Orbe), le pivot est souvent plus bas (facile à atteindre). Pour les pièces ATK, c'est plus exigeant !</p>
         </div>
     '''
-    return render_template_string(get_layout(content, "Lampa - Guide", "/guide"))
+    return get_layout(content, "Lampa - Guide", "/guide")
 
 # --- PAGE 3 : STATISTIQUES ---
-@app.route('/stats')
-def stats():
-    top_users = sorted(USAGE_STATS["users"].values(), key=lambda x: x['count'], reverse=True)[:10]
-    
-    # Génération HTML des tableaux
-    rows_users = "".join([f"<tr><td>{u['name']}</td><td><strong>{u['count']}</strong></td></tr>" for u in top_users])
-    rows_history = "".join([f"<tr><td>{i['user']}</td><td><span style='color:#00dbde'>/{i['command']}</span></td><td style='color:#aaa'>{i['time']}</td></tr>" for i in USAGE_STATS["history"]])
+def format_time(ts):
+    return datetime.datetime.fromtimestamp(ts).strftime("%d/%m %H:%M")
+
+STATS_MAX_ROWS = 500    # Plafond du paramètre `limit`
+STATS_CHUNK_ROWS = 50   # Lignes d'historique par morceau envoyé au client
+
+def parse_time(value):
+    """Timestamp Unix ou date ISO (2024-05-01, 2024-05-01T12:00) -> timestamp ; ValueError si invalide.
+
+    Le timestamp doit être affichable (fromtimestamp) : la page est déjà partie quand on l'affiche.
+    """
+    try:
+        ts = float(value)
+    except ValueError:
+        ts = None
+    try:
+        if ts is None:
+            ts = datetime.datetime.fromisoformat(value).timestamp()
+        if not math.isfinite(ts):
+            raise ValueError(f"date invalide : {value}")
+        datetime.datetime.fromtimestamp(ts)
+    except (OverflowError, OSError) as e:
+        raise ValueError(f"date hors limites : {value}") from e
+    return ts
+
+def parse_stats_query(args):
+    """Pagination et filtres de /stats depuis les paramètres d'URL (Flask ou aiohttp) ; ValueError si invalides"""
+    limit = int(args.get("limit") or STATS_HISTORY_ROWS)
+    if not 1 <= limit <= STATS_MAX_ROWS:
+        raise ValueError(f"limit doit être entre 1 et {STATS_MAX_ROWS}")
+    window = args.get("window") or None
+    if window is not None and window not in WINDOWS:
+        raise ValueError(f"window doit être parmi {', '.join(WINDOWS)}")
+    return {
+        "before": int(args["before"]) if args.get("before") else None,
+        "user": args.get("user") or None,
+        "command": (args.get("command") or "").lstrip("/") or None,
+        "since": parse_time(args["since"]) if args.get("since") else None,
+        "until": parse_time(args["until"]) if args.get("until") else None,
+        "limit": limit,
+        "window": window,
+    }
 
-    content = f'''
+class HistoryPage:
+    """Une page d'historique, parcourue une seule fois : `next_cursor` est connu à la fin du parcours"""
+
+    def __init__(self, snap, query):
+        self.limit = query["limit"]
+        filters = {key: query[key] for key in ("before", "user", "command", "since", "until")}
+        self._rows = islice(snap.page(**filters), self.limit + 1)  # +1 : savoir s'il reste une page
+        self.next_cursor = None
+
+    def __iter__(self):
+        last = None
+        for n, (seq, entry) in enumerate(self._rows):
+            if n == self.limit:
+                self.next_cursor = last
+                return
+            last = seq
+            yield seq, entry
+
+def stats_url(query, **changes):
+    """URL de /stats avec les mêmes filtres (None = paramètre retiré)"""
+    params = {**query, **changes}
+    for key in ("since", "until"):
+        if params[key] is not None:
+            params[key] = int(params[key])
+    if params["limit"] == STATS_HISTORY_ROWS:
+        params["limit"] = None
+    return "/stats?" + urlencode({key: value for key, value in params.items() if value is not None})
+
+def iter_stats_page(query):
+    """HTML de /stats en morceaux (partagé entre Flask et aiohttp) : l'en-tête part avant de lire l'historique"""
+    snap = ANALYTICS.snapshot()
+    head, tail = get_layout("\0", "Lampa - Stats", "/stats").split("\0")
+
+    # Pseudos échappés : ils viennent de Discord
+    rows_users = "".join([f"<tr><td>{escape(name)}</td><td><strong>{count}</strong></td></tr>" for name, count in snap.top_users])
+    since = datetime.datetime.fromtimestamp(query["since"]).strftime("%Y-%m-%dT%H:%M") if query["since"] is not None else ""
+    until = datetime.datetime.fromtimestamp(query["until"]).strftime("%Y-%m-%dT%H:%M") if query["until"] is not None else ""
+
+    yield head + f'''
         <h1 class="liquid-text">Statistiques en Temps Réel</h1>
         
         <div class="grid-3">
             <div class="glass-card">
-                <div style="font-size: 3em; font-weight: bold; color: #fff;">{USAGE_STATS["total_commands"]}</div>
+                <div style="font-size: 3em; font-weight: bold; color: #fff;">{snap.total_commands}</div>
                 <div style="color: #aaa;">Commandes Totales</div>
             </div>
             <div class="glass-card">
-                <div style="font-size: 3em; font-weight: bold; color: #fff;">{len(USAGE_STATS["users"])}</div>
+                <div style="font-size: 3em; font-weight: bold; color: #fff;">{snap.unique_users}</div>
                 <div style="color: #aaa;">Utilisateurs Uniques</div>
             </div>
         </div>
@@ -595,65 +1563,151 @@ def stats():
         </div>
 
         <div class="glass-card">
-            <h3>⏱️ Historique Récent</h3>
+            <h3>⏱️ Historique</h3>
+            <form method="get" action="/stats" style="display: flex; gap: 10px; flex-wrap: wrap; margin-bottom: 15px;">
+                <input name="user" placeholder="Pseudo" value="{escape(query["user"] or "")}">
+                <input name="command" placeholder="Commande (ex: roll)" value="{escape(query["command"] or "")}">
+                <input type="datetime-local" name="since" value="{since}">
+                <input type="datetime-local" name="until" value="{until}">
+                <button type="submit">Filtrer</button>
+                <a href="/stats" style="color:#aaa; align-self: center;">Réinitialiser</a>
+            </form>
             <table>
                 <tr><th>Utilisateur</th><th>Action</th><th>Heure</th></tr>
-                {rows_history}
-            </table>
-        </div>
     '''
-    return render_template_string(get_layout(content, "Lampa - Stats", "/stats"))
 
-# --- PAGE 4 : FARMING (PODIUM EDITION) ---
-@app.route('/farming')
-def farming():
-    content = '''
-        <h1 class="liquid-text" style="text-align: center; margin-bottom: 40px;">Rentabilité Enclumes - Merci à Wazdakka pour les data</h1>
-        
-        <!-- RESUME RAPIDE -->
-        <div style="text-align: center; margin-bottom: 50px;">
-            <p style="color: #ccc; font-size: 1.1em;">Comparatif sur <strong>8 heures de farm</strong> avec potions.</p>
+    page = HistoryPage(snap, query)
+    chunk = []
+    for _, i in page:
+        chunk.append(f"<tr><td>{escape(i['user'])}</td><td><span style='color:#00dbde'>/{escape(i['command'])}</span></td><td style='color:#aaa'>{format_time(i['ts'])}</td></tr>")
+        if len(chunk) == STATS_CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+
+    links = []
+    if query["before"] is not None:
+        links.append(f'<a href="{escape(stats_url(query, before=None))}" style="color:#00dbde">← Plus récents</a>')
+    if page.next_cursor is not None:
+        links.append(f'<a href="{escape(stats_url(query, before=page.next_cursor))}" style="color:#00dbde">Plus anciens →</a>')
+    yield "".join(chunk) + f'''
+            </table>
+            <p style="display: flex; justify-content: space-between; margin-top: 15px;">{"".join(links)}</p>
         </div>
+    ''' + tail
+
+def stats_json(query):
+    """Variante JSON de /stats (mêmes paramètres), pour les scripts.
+    Avec `window` (hour, day), top_users porte sur la fenêtre et suit le filtre `command`."""
+    snap = ANALYTICS.snapshot()
+    page = HistoryPage(snap, query)
+    history = [{"seq": seq, **entry} for seq, entry in page]
+    top_users = snap.top_users if query["window"] is None else ANALYTICS.top_users(command=query["command"], window=query["window"])
+    return json.dumps({
+        "total_commands": snap.total_commands,
+        "unique_users": snap.unique_users,
+        "top_users": [{"user": name, "count": count} for name, count in top_users],
+        "history": history,
+        "next_cursor": page.next_cursor,
+    }, ensure_ascii=False)
+
+def compress_stream(chunks, encoding):
+    """Compresse un flux morceau par morceau (chaque morceau est envoyé dès qu'il est prêt)"""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=COMPRESS_LEVEL["br"])
+        for chunk in chunks:
+            yield compressor.process(chunk.encode("utf-8")) + compressor.flush()
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(COMPRESS_LEVEL["gzip"], zlib.DEFLATED, 31)  # wbits 31 : format gzip
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+def stream_stats_page(query, accept_encoding):
+    """(en-têtes, morceaux en bytes) pour /stats"""
+    headers = {"Content-Type": "text/html; charset=utf-8", "Vary": "Accept-Encoding", "Cache-Control": "no-store"}
+    encoding = choose_encoding(accept_encoding)
+    if encoding == "identity":
+        return headers, (chunk.encode("utf-8") for chunk in iter_stats_page(query))
+    headers["Content-Encoding"] = encoding
+    return headers, compress_stream(iter_stats_page(query), encoding)
 
-        <!-- LE PODIUM -->
-        <div class="podium-container">
-            
-            <!-- 2ème Place : BDG NORMAL -->
-            <div class="podium-step step-2">
-                <div class="medal silver">2</div>
-                <h3>BdG (70 Stam)</h3>
-                <div class="stat-box">
-                    <span class="value">0,027</span>
-                    <span class="label">Enclume/Stam</span>
-                </div>
-                <p class="gain">~460 Enclumes</p>
-            </div>
+@app.route('/stats')
+def stats():
+    try:
+        query = parse_stats_query(request.args)
+    except ValueError:
+        abort(400)
+    headers, chunks = stream_stats_page(query, request.headers.get("Accept-Encoding"))
+    return Response(chunks, headers=headers)
+
+@app.route('/stats.json')
+def stats_data():
+    try:
+        query = parse_stats_query(request.args)
+    except ValueError:
+        abort(400)
+    return Response(stats_json(query), content_type="application/json", headers={"Cache-Control": "no-store"})
 
-            <!-- 1ère Place : BDG HALF STAMINA -->
+# --- PAGE 4 : FARMING (PODIUM EDITION) ---
+FARM_BAR_STYLES = ("background: linear-gradient(90deg, #00dbde, #fc00ff); box-shadow: 0 0 15px #fc00ff;", "background: #f39c12;", "background: #e74c3c;")
+
+def podium_step(place, res):
+    """Marche du podium pour la place `place` (1 à 3)"""
+    ratio = farm_model.format_ratio(res.anvils_per_stamina)
+    anvils = farm_model.format_count(res.anvils)
+    if place == 1:
+        return f'''
             <div class="podium-step step-1">
                 <div class="crown">👑</div>
                 <div class="medal gold">1</div>
-                <h3>BdG (Half-Stam)</h3>
+                <h3>{escape(res.stage.name)}</h3>
                 <div class="badge-winner">MEILLEUR RATIO</div>
                 <div class="stat-box winner-box">
-                    <span class="value">0,054</span>
+                    <span class="value">{ratio}</span>
                     <span class="label">Enclume/Stam</span>
                 </div>
-                <p class="gain gain-winner">915 Enclumes</p>
+                <p class="gain gain-winner">{anvils} Enclumes</p>
                 <p class="sub-gain">Le plus rentable !</p>
-            </div>
-
-            <!-- 3ème Place : DONJON OR -->
-            <div class="podium-step step-3">
-                <div class="medal bronze">3</div>
-                <h3>Donjon Or</h3>
+            </div>'''
+    medal = "silver" if place == 2 else "bronze"
+    return f'''
+            <div class="podium-step step-{place}">
+                <div class="medal {medal}">{place}</div>
+                <h3>{escape(res.stage.name)}</h3>
                 <div class="stat-box">
-                    <span class="value">0,020</span>
+                    <span class="value">{ratio}</span>
                     <span class="label">Enclume/Stam</span>
                 </div>
-                <p class="gain">240 Enclumes</p>
-            </div>
+                <p class="gain">{anvils} Enclumes</p>
+            </div>'''
+
+def render_farming_page(results, scenario):
+    """HTML de /farming à partir d'un classement de farm_model"""
+    top = results[:3]
+    # Podium dans l'ordre visuel 2 - 1 - 3
+    steps = "".join(podium_step(place, top[place - 1]) for place in (2, 1, 3) if place <= len(top))
+    best = results[0].anvils or 1
+    bars = []
+    for place, res in reversed(list(enumerate(top, 1))):
+        label_style = ' style="color: #00dbde; font-weight: bold;"' if place == 1 else ""
+        bars.append(f'''
+            <div class="chart-row">
+                <span class="chart-label"{label_style}>{escape(res.stage.short)}</span>
+                <div class="chart-bar" style="width: {res.anvils / best:.0%}; {FARM_BAR_STYLES[place - 1]}">{farm_model.format_count(res.anvils)}</div>
+            </div>''')
 
+    content = f'''
+        <h1 class="liquid-text" style="text-align: center; margin-bottom: 40px;">Rentabilité Enclumes - Merci à Wazdakka pour les data</h1>
+        
+        <!-- RESUME RAPIDE -->
+        <div style="text-align: center; margin-bottom: 50px;">
+            <p style="color: #ccc; font-size: 1.1em;">Comparatif sur <strong>{scenario.hours:g} heures de farm</strong> avec potions.</p>
+        </div>
+
+        <!-- LE PODIUM -->
+        <div class="podium-container">
+            {steps}
         </div>
 
         <!-- VISUALISATION DE L'ECART -->
@@ -662,106 +1716,279 @@ def farming():
             <p style="color: #aaa; margin-bottom: 20px;">Ce que vous perdez en farmant le Donjon Or au lieu d'attendre la Demi-Stamina.</p>
             
             <!-- Barres comparatives -->
-            <div class="chart-row">
-                <span class="chart-label">Donjon Or</span>
-                <div class="chart-bar" style="width: 26%; background: #e74c3c;">240</div>
-            </div>
-            <div class="chart-row">
-                <span class="chart-label">BDG (70 Stam)</span>
-                <div class="chart-bar" style="width: 50%; background: #f39c12;">460</div>
-            </div>
-            <div class="chart-row">
-                <span class="chart-label" style="color: #00dbde; font-weight: bold;">BDG (Half)</span>
-                <div class="chart-bar" style="width: 100%; background: linear-gradient(90deg, #00dbde, #fc00ff); box-shadow: 0 0 15px #fc00ff;">915</div>
-            </div>
+            {"".join(bars)}
         </div>
+    '''
+    return get_layout(content, "Lampa - Farming", "/farming", stylesheets=("farming.css",))
 
-        <!-- STYLE CSS SPECIFIQUE AU PODIUM (Intégré ici pour simplicité) -->
-        <style>
-            .podium-container {
-                display: flex;
-                align-items: flex-end;
-                justify-content: center;
-                gap: 20px;
-                margin-top: 20px;
-                height: 400px;
-            }
-
-            .podium-step {
-                background: rgba(255, 255, 255, 0.05);
-                backdrop-filter: blur(10px);
-                border: 1px solid rgba(255, 255, 255, 0.1);
-                border-radius: 15px 15px 0 0;
-                text-align: center;
-                padding: 20px;
-                position: relative;
-                transition: transform 0.3s ease;
-            }
-
-            .podium-step:hover { transform: translateY(-5px); }
-
-            /* HAUTEURS */
-            .step-1 { height: 100%; width: 35%; border-top: 2px solid #00dbde; background: linear-gradient(to bottom, rgba(0, 219, 222, 0.1), rgba(255,255,255,0.02)); z-index: 2; box-shadow: 0 0 30px rgba(0, 219, 222, 0.15); }
-            .step-2 { height: 75%; width: 30%; border-top: 2px solid #f39c12; }
-            .step-3 { height: 60%; width: 30%; border-top: 2px solid #e74c3c; }
-
-            /* MEDAILLES */
-            .medal {
-                width: 40px; height: 40px; line-height: 40px; border-radius: 50%;
-                font-weight: bold; font-size: 1.2em; margin: 0 auto 10px auto;
-                box-shadow: 0 4px 10px rgba(0,0,0,0.3);
-            }
-            .gold { background: linear-gradient(45deg, #ffd700, #fdb931); color: #000; }
-            .silver { background: linear-gradient(45deg, #e0e0e0, #bdbdbd); color: #000; }
-            .bronze { background: linear-gradient(45deg, #cd7f32, #a0522d); color: #fff; }
-
-            .crown { font-size: 2em; margin-bottom: -10px; animation: float 3s infinite ease-in-out; }
-
-            /* TEXTES */
-            h3 { font-size: 1.1em; margin: 10px 0; color: #fff; }
-            .stat-box { background: rgba(0,0,0,0.3); padding: 10px; border-radius: 8px; margin: 15px 0; }
-            .winner-box { background: rgba(0, 219, 222, 0.1); border: 1px solid rgba(0, 219, 222, 0.3); }
-            
-            .value { display: block; font-size: 1.8em; font-weight: bold; }
-            .step-1 .value { color: #00dbde; }
-            .step-2 .value { color: #f39c12; }
-            .step-3 .value { color: #e74c3c; }
-            
-            .label { font-size: 0.7em; text-transform: uppercase; letter-spacing: 1px; color: #aaa; }
-
-            .badge-winner {
-                background: linear-gradient(90deg, #00dbde, #fc00ff);
-                color: #000; font-weight: bold; font-size: 0.8em;
-                padding: 5px 10px; border-radius: 20px; display: inline-block; margin-bottom: 10px;
-            }
-
-            .gain { font-size: 1.2em; font-weight: bold; color: #fff; }
-            .gain-winner { font-size: 1.5em; text-shadow: 0 0 10px rgba(255,255,255,0.5); }
-            .sub-gain { font-size: 0.8em; color: #00dbde; }
-
-            /* GRAPHIQUE BARRES */
-            .chart-row { display: flex; align-items: center; margin-bottom: 15px; }
-            .chart-label { width: 100px; font-size: 0.9em; color: #ccc; }
-            .chart-bar { 
-                height: 30px; line-height: 30px; 
-                border-radius: 0 15px 15px 0; padding-left: 10px; 
-                color: #fff; font-weight: bold; font-size: 0.9em; text-shadow: 1px 1px 2px rgba(0,0,0,0.5);
-                transition: width 1s ease-out;
-            }
-        </style>
+@app.route('/farming')
+@cached_page(version=lambda: farm_model.VERSION)
+def farming():
+    return render_farming_page(farm_model.rank(), farm_model.DEFAULT_SCENARIO)
+
+
+# --- PAGE 5 : PERFORMANCES (temps de réponse) ---
+def render_perf_page():
+    """HTML de /perf : percentiles par span (commandes, modals, routes...)"""
+    rows = "".join(
+        f"<tr><td>{escape(name)}</td><td>{s['count']}</td><td>{s['p50_ms']:.1f}</td><td>{s['p95_ms']:.1f}</td>"
+        f"<td><strong>{s['p99_ms']:.1f}</strong></td><td style='color:#aaa'>{s['max_ms']:.1f}</td></tr>"
+        for name, s in TELEMETRY.summary().items()
+    )
+    content = f'''
+        <h1 class="liquid-text">Temps de Réponse</h1>
+
+        <div class="glass-card">
+            <h3>⏱️ Percentiles (ms)</h3>
+            <p style="color: #aaa;">Échantillonnage : {TELEMETRY.sample_rate:.0%} des appels • <a href="/perf.json" style="color:#00dbde">JSON</a></p>
+            <table>
+                <tr><th>Span</th><th>Appels</th><th>p50</th><th>p95</th><th>p99</th><th>Max</th></tr>
+                {rows}
+            </table>
+        </div>
     '''
-    return render_template_string(get_layout(content, "Lampa - Farming", "/farming"))
+    return get_layout(content, "Lampa - Performances", "/perf")
+
+def perf_json():
+    return json.dumps({"sample_rate": TELEMETRY.sample_rate, "spans": TELEMETRY.summary()})
+
+@app.route('/perf')
+def perf():
+    return render_perf_page()
+
+@app.route('/perf.json')
+def perf_data():
+    return Response(perf_json(), content_type="application/json", headers={"Cache-Control": "no-store"})
+
+# --- MÉTRIQUES PROMETHEUS ---
+# Chaque valeur est déjà tenue à jour ailleurs : un scrape coûte O(nombre de métriques),
+# sans parcourir utilisateurs ni historique, et ne prend que des verrous de quelques opérations.
+def _metric_value(value):
+    if value != value:
+        return "NaN"
+    if value in (math.inf, -math.inf):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _metric_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        key + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+def _metric(lines, name, kind, help_text, samples):
+    """Ajoute une famille de métriques : samples = [(suffixe, {labels}, valeur)]"""
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for suffix, labels, value in samples:
+        lines.append(f"{name}{suffix}{_metric_labels(labels)} {_metric_value(value)}")
+
+def process_rss_bytes():
+    """Mémoire résidente actuelle (Linux), sinon None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def open_view_counts():
+    """Vues suivies par discord.py (lecture de tailles de dict, sans les parcourir)"""
+    store = getattr(client._connection, "_view_store", None)
+    if store is None:
+        return {}
+    return {
+        "persistent": len(PERSISTENT_VIEWS),
+        "message": len(store._synced_message_views),
+        "modal": len(store._modals),
+    }
 
+def render_metrics():
+    """Format texte d'exposition Prometheus"""
+    snap = ANALYTICS.snapshot()
+    lines = []
+    _metric(lines, "lampa_commands_total", "counter", "Commandes utilisées, par commande",
+            [("", {"command": command}, count) for command, count in snap.command_counts])
+    _metric(lines, "lampa_unique_users", "gauge", "Utilisateurs distincts depuis le début",
+            [("", {}, snap.unique_users)])
+    _metric(lines, "lampa_interaction_responses_total", "counter", "Réponses aux interactions, directes ou après defer",
+            [("", {"handler": name, "path": path}, count)
+             for name, paths in list(RESPONSE_PATHS.items()) for path, count in list(paths.items())])
+    _metric(lines, "lampa_gateway_latency_seconds", "gauge", "Latence du heartbeat de la gateway Discord",
+            [("", {}, client.latency)])
+    _metric(lines, "lampa_event_loop_lag_seconds", "gauge", "Retard de la boucle asyncio du bot (dernière mesure)",
+            [("", {}, LOOP_LAG["current"])])
+    _metric(lines, "lampa_event_loop_lag_max_seconds", "gauge", "Plus grand retard mesuré depuis le démarrage",
+            [("", {}, LOOP_LAG["max"])])
+    _metric(lines, "lampa_open_views", "gauge", "Vues et modals suivis par discord.py",
+            [("", {"kind": kind}, count) for kind, count in open_view_counts().items()])
+    rss = process_rss_bytes()
+    if rss is not None:
+        _metric(lines, "process_resident_memory_bytes", "gauge", "Mémoire résidente du processus", [("", {}, rss)])
+    samples = []
+    for name, s in TELEMETRY.summary().items():
+        for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+            samples.append(("", {"span": name, "quantile": quantile}, s[key] / 1000))
+        samples.append(("_sum", {"span": name}, s["total_ms"] / 1000))
+        samples.append(("_count", {"span": name}, s["count"]))
+    _metric(lines, "lampa_span_duration_seconds", "summary", "Durée des commandes, modals et routes web", samples)
+    return "\n".join(lines) + "\n"
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE, headers={"Cache-Control": "no-store"})
+
+# --- SONDE DE SANTÉ (Render) ---
+@app.route('/health')
+def health():
+    """Réponse minimale pour les pings de disponibilité : ne touche ni au cache ni aux stats"""
+    return Response("OK", content_type="text/plain", headers={"Cache-Control": "no-store"})
+
+# === SERVEUR WEB ===
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", "8080"))
+WEB_SERVER = os.getenv("WEB_SERVER", "waitress")  # "waitress" (production), "aiohttp" (boucle du bot) ou "werkzeug" (dev)
+WEB_THREADS = int(os.getenv("WEB_THREADS", "4"))  # Workers waitress
+WEB_BACKLOG = int(os.getenv("WEB_BACKLOG", "256"))  # File d'attente TCP
+WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "30"))  # Secondes avant de fermer une connexion keep-alive inactive
+WEB_CONNECTION_LIMIT = int(os.getenv("WEB_CONNECTION_LIMIT", "100"))
 
 def run_web():
-    app.run(host='0.0.0.0', port=8080)
-
+    """Serveur web dans un thread à part (modes waitress / werkzeug)"""
+    if WEB_SERVER == "waitress" and waitress_serve is not None:
+        waitress_serve(
+            app, host=WEB_HOST, port=WEB_PORT, threads=WEB_THREADS, backlog=WEB_BACKLOG,
+            channel_timeout=WEB_KEEPALIVE, connection_limit=WEB_CONNECTION_LIMIT, ident="Lampa",
+        )
+        return
+    if WEB_SERVER == "waitress":
+        print("⚠️ waitress n'est pas installé : serveur de dev Werkzeug")
+    app.run(host=WEB_HOST, port=WEB_PORT, threaded=True)
+
+
+# --- MODE AIOHTTP : le site tourne sur la boucle asyncio du bot, sans thread ---
+def _aiohttp_cached(get_cached):
+    async def handler(request):
+        status, headers, body = get_cached().respond(request.headers.get("If-None-Match"), request.headers.get("Accept-Encoding"))
+        return web.Response(body=body, status=status, headers=headers)
+    return handler
+
+async def _aiohttp_asset(request):
+    cached = ASSETS.get(request.match_info["name"])
+    if cached is None:
+        raise web.HTTPNotFound()
+    return await _aiohttp_cached(lambda: cached)(request)
+
+async def _aiohttp_stats(request):
+    try:
+        query = parse_stats_query(request.query)
+    except ValueError:
+        raise web.HTTPBadRequest()
+    headers, chunks = stream_stats_page(query, request.headers.get("Accept-Encoding"))
+    response = web.StreamResponse(headers=headers)
+    await response.prepare(request)
+    for chunk in chunks:
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+async def _aiohttp_stats_data(request):
+    try:
+        query = parse_stats_query(request.query)
+    except ValueError:
+        raise web.HTTPBadRequest()
+    return web.Response(text=stats_json(query), content_type="application/json", headers={"Cache-Control": "no-store"})
+
+async def _aiohttp_health(request):
+    return web.Response(text="OK", headers={"Cache-Control": "no-store"})
+
+async def _aiohttp_perf(request):
+    data, encoding = compress_dynamic(render_perf_page().encode("utf-8"), request.headers.get("Accept-Encoding"))
+    headers = {"Content-Type": "text/html; charset=utf-8", "Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return web.Response(body=data, headers=headers)
+
+async def _aiohttp_perf_data(request):
+    return web.Response(text=perf_json(), content_type="application/json", headers={"Cache-Control": "no-store"})
+
+async def _aiohttp_metrics(request):
+    return web.Response(body=render_metrics().encode("utf-8"), headers={"Content-Type": METRICS_CONTENT_TYPE, "Cache-Control": "no-store"})
+
+@web.middleware
+async def _aiohttp_route_span(request, handler):
+    """Même nommage des spans que côté Flask (web:<endpoint>)"""
+    name = request.match_info.route.name
+    if name is None:
+        return await handler(request)
+    with TELEMETRY.span(f"web:{name}"):
+        return await handler(request)
+
+def build_web_app():
+    """Application aiohttp équivalente à l'app Flask"""
+    web_app = web.Application(middlewares=[_aiohttp_route_span])
+    # Noms de route = endpoints Flask, pour des spans communs
+    web_app.router.add_get("/", _aiohttp_cached(home.get_cached), name="home")
+    web_app.router.add_get("/guide", _aiohttp_cached(guide.get_cached), name="guide")
+    web_app.router.add_get("/farming", _aiohttp_cached(farming.get_cached), name="farming")
+    web_app.router.add_get("/stats", _aiohttp_stats, name="stats")
+    web_app.router.add_get("/stats.json", _aiohttp_stats_data, name="stats_data")
+    web_app.router.add_get("/perf", _aiohttp_perf, name="perf")
+    web_app.router.add_get("/perf.json", _aiohttp_perf_data, name="perf_data")
+    web_app.router.add_get("/assets/{name}", _aiohttp_asset, name="asset")
+    web_app.router.add_get("/metrics", _aiohttp_metrics, name="metrics")
+    web_app.router.add_get("/health", _aiohttp_health, name="health")
+    return web_app
+
+async def start_web_async():
+    """Démarre le site sur la boucle courante (celle de `client`)"""
+    runner = web.AppRunner(build_web_app(), access_log=None, keepalive_timeout=WEB_KEEPALIVE)
+    await runner.setup()
+    await web.TCPSite(runner, WEB_HOST, WEB_PORT, backlog=WEB_BACKLOG).start()
+    print(f"🌐 Site servi par aiohttp sur le port {WEB_PORT}")
+    return runner
+
+def install_signal_handlers():
+    """SIGTERM (arrêt du dyno par Render) : fermeture propre du client, client.run rend alors la main.
+    SIGHUP (kill -HUP) : relire les images. Exécutés par la boucle, pas dans un handler signal brut."""
+    # client.run ne gère que KeyboardInterrupt : sans ça, atexit ne tourne jamais
+    loop = asyncio.get_running_loop()
+    handlers = {"SIGTERM": lambda: asyncio.create_task(client.close()), "SIGHUP": reload_images}
+    for name, handler in handlers.items():
+        try:
+            loop.add_signal_handler(getattr(signal, name), handler)
+        except (NotImplementedError, AttributeError):  # Windows
+            pass
+
+async def setup_hook():
+    """Appelé une seule fois par discord.py, sur sa boucle, avant la connexion"""
+    # Ici et pas dans on_ready, qui est rappelé à chaque reconnexion
+    register_persistent_views()
+    TEMPLATES.warm()
+    client.loop_lag_task = asyncio.create_task(monitor_loop_lag())
+    install_signal_handlers()
+    if WEB_SERVER == "aiohttp":
+        await start_web_async()  # Avant la synchro : le port du health check doit répondre au plus tôt
+    await sync_commands(force=os.getenv("FORCE_SYNC") == "1")
+
+client.setup_hook = setup_hook
 
 if __name__ == "__main__":
-    web_thread = Thread(target=run_web)
-    web_thread.daemon = True
-    web_thread.start()
-    client.run(TOKEN)
+    journal = start_analytics_journal()
+    IMAGES.reload()
+    if WEB_SERVER != "aiohttp":
+        web_thread = Thread(target=run_web)
+        web_thread.daemon = True
+        web_thread.start()
+    try:
+        client.run(TOKEN)
+    finally:
+        if journal is not None:
+            journal.close()  # Dernière écriture + compaction, même après un SIGTERM
 
 
 
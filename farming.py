@@ -0,0 +1,99 @@
+"""Modèle de rentabilité du farm d'enclumes (données : Wazdakka)"""
+from dataclasses import dataclass, replace
+from functools import lru_cache
+
+@dataclass(frozen=True)
+class Stage:
+    """Un contenu farmable, décrit par run"""
+    key: str
+    name: str         # Nom affiché sur /farm
+    short: str        # Libellé court (barres du site)
+    stamina: int      # Coût d'une run
+    run_seconds: float  # Durée d'une run
+    anvils: float = 0.0  # Enclumes tombées par run
+    gold: int = 0        # Or gagné par run (converti en tirages)
+    note: str = ""       # Commentaire affiché quand l'étape n'est pas première
+
+@dataclass(frozen=True)
+class Scenario:
+    """Conditions d'une session de farm"""
+    hours: float = 8
+    regen_per_hour: float = 12     # Stamina naturelle (1 toutes les 5 min)
+    potion_interval: float = 170   # Secondes entre deux potions (rythme tenu toute la session)
+    potion_stamina: int = 100
+    anvils_per_draw: float = 0.66
+    gold_per_draw: int = 200_000
+    stamina_factor: float = 1.0  # 0.5 pendant une fenêtre demi-stamina
+    drop_factor: float = 1.0     # Bonus de drop d'événement
+
+    @property
+    def stamina_budget(self):
+        """Stamina disponible sur la session : régénération et potions sont des débits, le budget suit la durée"""
+        return self.hours * (self.regen_per_hour + 3600 / self.potion_interval * self.potion_stamina)
+
+@dataclass(frozen=True)
+class StageResult:
+    stage: Stage
+    anvils_per_stamina: float
+    runs: float
+    stamina_used: float
+    anvils: float
+    limited_by: str  # "stamina" ou "temps"
+
+# Calibré sur les relevés de Wazdakka (8 h) : 915 / ~460 / 240 enclumes
+STAGES = (
+    Stage("bdg_half", "BdG (Half-Stam)", "BDG (Half)", stamina=35, run_seconds=59.5, anvils=1.89),
+    Stage("bdg", "BdG (70 Stam)", "BDG (70 Stam)", stamina=70, run_seconds=59.5, anvils=1.89, note="Coûteux en potions."),
+    Stage("gold", "Donjon Or", "Donjon Or", stamina=30, run_seconds=72, gold=182_000, note="À éviter pour les enclumes."),
+)
+DEFAULT_SCENARIO = Scenario()
+VERSION = 0  # Incrémenté à chaque changement des données : les rendus (embed, page) se reconstruisent
+
+def configure(stages=None, scenario=None):
+    """Remplace les données du modèle (étapes et/ou scénario par défaut)"""
+    global STAGES, DEFAULT_SCENARIO, VERSION
+    if stages is not None:
+        STAGES = tuple(stages)
+    if scenario is not None:
+        DEFAULT_SCENARIO = scenario
+    VERSION += 1
+
+def evaluate(stage, scenario):
+    """Projection d'une étape : la session s'arrête au premier des deux épuisés, stamina ou temps"""
+    cost = stage.stamina * scenario.stamina_factor
+    per_run = (stage.anvils + stage.gold / scenario.gold_per_draw * scenario.anvils_per_draw) * scenario.drop_factor
+    by_stamina = scenario.stamina_budget / cost
+    by_time = scenario.hours * 3600 / stage.run_seconds
+    runs = min(by_stamina, by_time)
+    return StageResult(
+        stage=stage,
+        anvils_per_stamina=per_run / cost,
+        runs=runs,
+        stamina_used=runs * cost,
+        anvils=runs * per_run,
+        limited_by="stamina" if by_stamina <= by_time else "temps",
+    )
+
+@lru_cache(maxsize=4096)
+def _rank(scenario, stages):
+    return tuple(sorted((evaluate(stage, scenario) for stage in stages), key=lambda r: r.anvils, reverse=True))
+
+def rank(scenario=None, stages=None):
+    """Étapes classées de la plus à la moins rentable (enclumes sur la session), mémoïsé par paramètres"""
+    return _rank(DEFAULT_SCENARIO if scenario is None else scenario, STAGES if stages is None else tuple(stages))
+
+def for_hours(hours):
+    """Classement du scénario par défaut sur une autre durée de session"""
+    return rank(replace(DEFAULT_SCENARIO, hours=hours))
+
+def sweep(scenarios, stages=None):
+    """{scénario: classement} pour une série de scénarios (événements, demi-stamina...)"""
+    stages = STAGES if stages is None else tuple(stages)
+    return {scenario: _rank(scenario, stages) for scenario in scenarios}
+
+def format_ratio(value):
+    """0.054 -> "0,054" (notation française du site et de l'embed)"""
+    return f"{value:.3f}".replace(".", ",")
+
+def format_count(value):
+    return f"{value:,.0f}".replace(",", " ")
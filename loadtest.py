@@ -0,0 +1,400 @@
+"""Test de charge de bout en bout, sans Discord.
+
+Une fausse gateway injecte des interactions (commandes slash, clics de bouton,
+modals soumis) dans `tree` et le ViewStore de discord.py, comme le ferait la
+connexion réelle, à un débit et une concurrence donnés. Les réponses
+(send_message / send_modal / defer) sont capturées au lieu d'être envoyées.
+En parallèle, des threads peuvent charger le site Flask servi en local.
+
+    python loadtest.py --rate 50 --duration 30 --concurrency 100
+    python loadtest.py --rate 20 --duration 60 --http-workers 8 --json rapport.json
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import os
+import random
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+
+# Avant d'importer bot : sans fichier SQLite
+os.environ.setdefault("ANALYTICS_DB", "")
+
+import discord
+import bot
+from bench import FakeFollowup, FakeInteraction, FakeResponse
+from telemetry import LatencyHistogram
+
+RESPONSE_TIMEOUT = 3.0  # Délai de Discord pour la première réponse
+
+# === FAUSSE GATEWAY ===
+class GatewayResponse(FakeResponse):
+    """Comme InteractionResponse : les vues et modals non arrêtés sont gardés par discord.py"""
+
+    def __init__(self, interaction):
+        super().__init__()
+        self._interaction = interaction
+        self.first = asyncio.Event()
+        self.first_at = None
+        self.modal = None
+        self.view = None
+        self.deferred = False
+
+    def _responded(self):
+        if self.first_at is None:
+            self.first_at = time.perf_counter()
+            self.first.set()
+
+    async def defer(self, thinking=False, ephemeral=False):
+        await super().defer(thinking, ephemeral)
+        self.deferred = True
+        self._responded()
+
+    async def send_message(self, content=None, **kwargs):
+        await super().send_message(content, **kwargs)
+        view = kwargs.get("view")
+        if view is not None and not view.is_finished():
+            bot.client._connection.store_view(view, self._interaction.id)
+        self.view = view
+        self._responded()
+
+    async def send_modal(self, modal):
+        await super().send_modal(modal)
+        if not modal.is_finished():
+            bot.client._connection.store_view(modal)
+        self.modal = modal
+        self._responded()
+
+class GatewayMessage:
+    def __init__(self, message_id):
+        self.id = message_id
+        self.interaction = None
+
+    async def delete(self):
+        pass
+
+class GatewayInteraction(FakeInteraction):
+    """Interaction telle que discord.py la construit à partir d'un événement INTERACTION_CREATE"""
+
+    _ids = iter(range(1, 1 << 62))
+
+    def __init__(self, kind, user_id, data, message=None):
+        super().__init__(user_id)
+        # Snowflakes uniques même pour des interactions créées dans la même milliseconde
+        self.id = discord.utils.time_snowflake(discord.utils.utcnow()) + next(self._ids) % 4096
+        self.type = kind
+        self.data = data
+        self.guild_id = None
+        self.command_failed = False
+        self.message = message
+        self._state = bot.client._connection
+        self._client = bot.client
+        self.created = time.perf_counter()
+        self.response = GatewayResponse(self)
+        self.followup = FakeFollowup(self.response)
+
+class FakeGateway:
+    """Rejoue des parcours utilisateurs complets et mesure les temps de première réponse"""
+
+    def __init__(self, users=5000, seed=None):
+        self.users = users
+        self.rng = random.Random(seed)
+        self.store = bot.client._connection._view_store
+        self.latency = {}     # {étape: LatencyHistogram} (µs, jusqu'à la première réponse)
+        self.counts = {"ok": 0, "deferred": 0, "timeout": 0, "error": 0}
+
+    def _record(self, step, interaction):
+        response = interaction.response
+        if response.first_at is None:
+            self.counts["timeout"] += 1
+            return
+        histogram = self.latency.get(step)
+        if histogram is None:
+            histogram = self.latency[step] = LatencyHistogram()
+        histogram.record(int((response.first_at - interaction.created) * 1_000_000))
+        self.counts["deferred" if response.deferred else "ok"] += 1
+
+    async def _wait(self, step, interaction):
+        try:
+            await asyncio.wait_for(interaction.response.first.wait(), RESPONSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        self._record(step, interaction)
+
+    async def slash(self, user_id, name, **options):
+        option_types = {int: 4, str: 3, float: 10}
+        data = {"id": 0, "name": name, "type": 1,
+                "options": [{"name": key, "type": option_types[type(value)], "value": value} for key, value in options.items()]}
+        interaction = GatewayInteraction(discord.InteractionType.application_command, user_id, data)
+        await bot.tree._call(interaction)
+        self._record(f"/{name}", interaction)
+        return interaction
+
+    async def click(self, user_id, message, custom_id):
+        data = {"custom_id": custom_id, "component_type": 2}
+        interaction = GatewayInteraction(discord.InteractionType.component, user_id, data, message)
+        self.store.dispatch_view(2, custom_id, interaction)  # Tâche planifiée, comme discord.py
+        await self._wait(f"button:{custom_id.split(':')[0]}", interaction)
+        return interaction
+
+    async def submit(self, user_id, modal, values, step):
+        components = [{"type": 1, "components": [{"type": 4, "custom_id": item.custom_id, "value": value}]}
+                      for item, value in zip(modal.children, values)]
+        data = {"custom_id": modal.custom_id, "components": components}
+        interaction = GatewayInteraction(discord.InteractionType.modal_submit, user_id, data)
+        self.store.dispatch_modal(modal.custom_id, interaction, components)
+        await self._wait(step, interaction)
+        return interaction
+
+    # --- Parcours ---
+    def _stats(self, base):
+        bonus = self.rng.randint(base // 4, base // 2)
+        return str(base + bonus), str(bonus)
+
+    async def pivot_flow(self, user_id):
+        opened = await self.slash(user_id, "pivot")
+        modal = opened.response.modal
+        if modal is not None:
+            await self.submit(user_id, modal, (*self._stats(self.rng.randint(60_000, 250_000)), *self._stats(self.rng.randint(4_000, 15_000))), "modal:pivot")
+
+    async def roll_flow(self, user_id):
+        opened = await self.slash(user_id, "roll")
+        gear = self.rng.choice(bot.GEAR_KEYS[:4])
+        base = self.rng.randint(60_000, 250_000) if bot.GEAR_DATA[gear]["type"] == "HP" else self.rng.randint(4_000, 15_000)
+        clicked = await self.click(user_id, GatewayMessage(opened.id), f"roll:{gear}")
+        modal = clicked.response.modal
+        if modal is not None:
+            values = (*self._stats(base), str(self.rng.choice((80, 90, 100))), str(round(self.rng.uniform(0, 12), 1)))
+            await self.submit(user_id, modal, values, "modal:roll")
+
+    async def stuff_flow(self, user_id):
+        stats = {}
+        for stat, low, high in (("hp", 60_000, 250_000), ("atk", 4_000, 15_000), ("def", 2_000, 9_000)):
+            noir, vert = self._stats(self.rng.randint(low, high))
+            stats[f"{stat}_noir"], stats[f"{stat}_vert"] = int(noir), int(vert)
+        await self.slash(user_id, "stuff", **stats, bague=f"{self.rng.choice((90, 100))}/{self.rng.randint(0, 12)}")
+
+    async def farm_flow(self, user_id):
+        if self.rng.random() < 0.3:
+            await self.slash(user_id, "farm", heures=float(self.rng.choice((2, 4, 12, 24))))
+        else:
+            await self.slash(user_id, "farm")
+
+    async def help_flow(self, user_id):
+        await self.slash(user_id, "help")
+
+    FLOWS = (("pivot_flow", 30), ("roll_flow", 30), ("stuff_flow", 15), ("farm_flow", 10), ("help_flow", 15))
+
+    async def session(self):
+        names, weights = zip(*self.FLOWS)
+        flow = getattr(self, self.rng.choices(names, weights)[0])
+        try:
+            await flow(self.rng.randrange(self.users))
+        except Exception as e:
+            self.counts["error"] += 1
+            print(f"⚠️ {type(e).__name__}: {e}")
+
+# === CHARGE HTTP (threads, comme les clients du site) ===
+HTTP_ROUTES = ("/", "/guide", "/farming", "/stats", "/stats.json", "/perf", "/metrics", "/health")
+
+def start_web_server():
+    """Site Flask sur un port libre en local, avec le serveur de production si disponible : (url, arrêt)"""
+    if bot.waitress_serve is not None:
+        from waitress.server import create_server
+        server = create_server(bot.app, host="127.0.0.1", port=0, threads=bot.WEB_THREADS)
+        threading.Thread(target=server.run, daemon=True).start()
+        return f"http://127.0.0.1:{server.effective_port}", server.close
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", 0, bot.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+class HttpLoad:
+    def __init__(self, base_url, workers, deadline):
+        self.base_url = base_url
+        self.workers = workers
+        self.deadline = deadline
+        self.latency = {route: LatencyHistogram() for route in HTTP_ROUTES}
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def _worker(self, seed):
+        rng = random.Random(seed)
+        while time.monotonic() < self.deadline:
+            route = rng.choice(HTTP_ROUTES)
+            request = urllib.request.Request(self.base_url + route, headers={"Accept-Encoding": "gzip"})
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    response.read()
+            except (urllib.error.URLError, OSError):
+                with self._lock:
+                    self.errors += 1
+                continue
+            elapsed = int((time.perf_counter() - started) * 1_000_000)
+            with self._lock:
+                self.latency[route].record(elapsed)
+
+    def start(self):
+        threads = [threading.Thread(target=self._worker, args=(i,), daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+# === MESURES ===
+async def sample_loop_lag(histogram, stop, interval=0.01):
+    """Retard de réveil de la boucle (µs), toutes les `interval` secondes"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        histogram.record(int(max(loop.time() - started - interval, 0) * 1_000_000))
+
+def memory_state():
+    """Objets qui peuvent s'accumuler pendant la charge"""
+    store = bot.client._connection._view_store
+    gc.collect()
+    live = {"RollView": 0, "PivotActionView": 0, "Modal": 0}
+    for obj in gc.get_objects():
+        if isinstance(obj, bot.RollView):
+            live["RollView"] += 1
+        elif isinstance(obj, bot.PivotActionView):
+            live["PivotActionView"] += 1
+        elif isinstance(obj, discord.ui.Modal):
+            live["Modal"] += 1
+    snap = bot.ANALYTICS.snapshot()
+    return {
+        "rss_bytes": bot.process_rss_bytes(),
+        "live_views": live,
+        "view_store": {"views": len(store._views), "message_views": len(store._synced_message_views), "modals": len(store._modals)},
+        "analytics_users": snap.unique_users,
+        "analytics_history": len(bot.ANALYTICS._history),
+    }
+
+def summarize(histogram):
+    if not histogram.count:
+        return None
+    p = histogram.percentiles((0.5, 0.95, 0.99))
+    return {
+        "count": histogram.count,
+        "p50_ms": p[0.5] / 1000,
+        "p95_ms": p[0.95] / 1000,
+        "p99_ms": p[0.99] / 1000,
+        "max_ms": histogram.max_us / 1000,
+    }
+
+async def run_load(args):
+    bot.register_persistent_views()
+    bot.TEMPLATES.warm()
+    bot.IMAGES.reload()  # Comme __main__
+
+    gateway = FakeGateway(args.users, args.seed)
+    before = memory_state()
+    if args.tracemalloc:
+        tracemalloc.start(10)
+        traced_before = tracemalloc.take_snapshot()
+
+    http = stop_web = None
+    if args.http_workers:
+        base_url, stop_web = start_web_server()
+        http = HttpLoad(base_url, args.http_workers, time.monotonic() + args.duration)
+        http.start()
+
+    lag = LatencyHistogram()
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(sample_loop_lag(lag, stop))
+
+    in_flight = set()
+    saturated = 0
+    started = time.perf_counter()
+    interval = 1 / args.rate
+    next_at = started
+    while time.perf_counter() - started < args.duration:
+        # Arrivées en boucle ouverte : le débit ne ralentit pas si le bot ralentit
+        if len(in_flight) < args.concurrency:
+            task = asyncio.create_task(gateway.session())
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        else:
+            saturated += 1
+        next_at += interval
+        await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+    if in_flight:
+        await asyncio.wait(in_flight, timeout=RESPONSE_TIMEOUT * 4)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+
+    report = {
+        "duration_s": round(elapsed, 2),
+        "sessions": int(args.rate * args.duration) - saturated,
+        "saturated": saturated,
+        "responses": dict(gateway.counts),
+        "throughput_per_s": round(sum(gateway.counts.values()) / elapsed, 1),
+        "latency": {step: summarize(h) for step, h in sorted(gateway.latency.items())},
+        "loop_lag": summarize(lag),
+        "memory": {"before": before, "after": memory_state()},
+    }
+    if args.tracemalloc:
+        growth = tracemalloc.take_snapshot().compare_to(traced_before, "lineno")[:10]
+        report["memory"]["top_growth"] = [f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} +{stat.size_diff / 1024:.0f} KiB" for stat in growth]
+        tracemalloc.stop()
+    if http is not None:
+        report["http"] = {
+            "workers": args.http_workers,
+            "errors": http.errors,
+            "requests_per_s": round(sum(h.count for h in http.latency.values()) / elapsed, 1),
+            "latency": {route: summarize(h) for route, h in http.latency.items()},
+        }
+        stop_web()
+    return report
+
+def print_report(report):
+    print(f"\n🚦 {report['sessions']} parcours en {report['duration_s']} s "
+          f"({report['throughput_per_s']} réponses/s, {report['saturated']} refusés faute de place)")
+    print(f"   Réponses : {report['responses']}")
+    print(f"\n{'étape':<16}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    rows = list(report["latency"].items()) + [("boucle (retard)", report["loop_lag"])]
+    rows += [(f"web {route}", s) for route, s in report.get("http", {}).get("latency", {}).items()]
+    for name, s in rows:
+        if s:
+            print(f"{name:<16}{s['count']:>7}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}")
+    if "http" in report:
+        print(f"\n🌐 HTTP : {report['http']['requests_per_s']} req/s, {report['http']['errors']} erreurs")
+    before, after = report["memory"]["before"], report["memory"]["after"]
+    if before["rss_bytes"] and after["rss_bytes"]:
+        print(f"\n🧠 RSS : {before['rss_bytes'] / 2**20:.1f} → {after['rss_bytes'] / 2**20:.1f} Mio")
+    print(f"   Vues vivantes : {before['live_views']} → {after['live_views']}")
+    print(f"   ViewStore : {before['view_store']} → {after['view_store']}")
+    print(f"   Analytics : {before['analytics_users']} → {after['analytics_users']} utilisateurs, "
+          f"{before['analytics_history']} → {after['analytics_history']} lignes d'historique")
+    for line in report["memory"].get("top_growth", []):
+        print(f"   + {line}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge du Lampa Calculator (fausse gateway Discord)")
+    parser.add_argument("--rate", type=float, default=20, help="Parcours utilisateurs démarrés par seconde")
+    parser.add_argument("--duration", type=float, default=30, help="Durée de l'injection (s)")
+    parser.add_argument("--concurrency", type=int, default=100, help="Parcours simultanés max")
+    parser.add_argument("--users", type=int, default=5000, help="Nombre d'utilisateurs distincts simulés")
+    parser.add_argument("--http-workers", type=int, default=0, help="Threads clients HTTP sur le site (0 = pas de charge web)")
+    parser.add_argument("--tracemalloc", action="store_true", help="Détaille la croissance mémoire (ralentit la charge)")
+    parser.add_argument("--quiet", action="store_true", help="Masque les logs du bot pendant la charge")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", dest="json_path", help="Écrit aussi le rapport en JSON")
+    args = parser.parse_args(argv)
+
+    with contextlib.redirect_stdout(None) if args.quiet else contextlib.nullcontext():
+        report = asyncio.run(run_load(args))
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
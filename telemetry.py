@@ -0,0 +1,159 @@
+"""Mesure des temps de réponse du bot et du site (histogrammes à mémoire fixe)"""
+import random
+import threading
+import time
+from contextlib import nullcontext
+from functools import wraps
+from inspect import iscoroutinefunction
+
+class LatencyHistogram:
+    """Histogramme log-linéaire façon HDR : mémoire fixe, ajout en O(1).
+
+    Les durées sont comptées en microsecondes. Chaque puissance de deux est
+    découpée en 8 paniers, soit une erreur relative d'au plus 12,5 % sur les
+    percentiles, de 1 µs jusqu'à 2^27 µs ≈ 134 s (au-delà, tout tombe dans le dernier panier).
+    """
+
+    SUB_BITS = 3
+    SUB_COUNT = 1 << SUB_BITS
+    BUCKETS = 200
+
+    def __init__(self):
+        self._counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    @classmethod
+    def _index(cls, us):
+        if us < 2 * cls.SUB_COUNT:
+            return us
+        shift = us.bit_length() - cls.SUB_BITS - 1
+        return min(shift * cls.SUB_COUNT + (us >> shift), cls.BUCKETS - 1)
+
+    @classmethod
+    def _upper(cls, index):
+        """Plus grande durée (µs) rangée dans le panier `index`"""
+        if index < 2 * cls.SUB_COUNT:
+            return index
+        shift, mantissa = divmod(index, cls.SUB_COUNT)
+        shift -= 1
+        return ((mantissa + cls.SUB_COUNT + 1) << shift) - 1
+
+    def record(self, us):
+        self._counts[self._index(us)] += 1
+        self.count += 1
+        self.total_us += us
+        if us > self.max_us:
+            self.max_us = us
+
+    def percentiles(self, quantiles):
+        """{q: durée en µs} pour chaque quantile de `quantiles` (triés), en un seul parcours"""
+        counts = list(self._counts)
+        total = sum(counts)
+        result = dict.fromkeys(quantiles, 0)
+        if not total:
+            return result
+        pending = iter(sorted(quantiles))
+        q = next(pending)
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            while seen >= q * total:
+                result[q] = min(self._upper(index), self.max_us)
+                q = next(pending, None)
+                if q is None:
+                    return result
+        return result
+
+class _Span:
+    __slots__ = ("_telemetry", "_name", "_start")
+
+    def __init__(self, telemetry, name):
+        self._telemetry = telemetry
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self._telemetry.record(self._name, (time.perf_counter_ns() - self._start) // 1000)
+        return False
+
+_NO_SPAN = nullcontext()
+
+class Telemetry:
+    """Spans nommés → un LatencyHistogram par nom.
+
+    `sample_rate` : part des spans mesurés (1 = tous, 0 = aucun). Un span non
+    échantillonné est un simple nullcontext partagé, sans horloge ni verrou.
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self._histograms = {}
+        self._lock = threading.Lock()  # Spans enregistrés depuis la boucle du bot ET les threads web
+
+    def span(self, name):
+        """Context manager mesurant la durée du bloc"""
+        rate = self.sample_rate
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return _NO_SPAN
+        return _Span(self, name)
+
+    def begin(self):
+        """Début d'un span ouvert et fermé à deux endroits différents (hooks avant/après) : jeton pour end()"""
+        rate = self.sample_rate
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return None
+        return time.perf_counter_ns()
+
+    def end(self, name, started):
+        if started is not None:
+            self.record(name, (time.perf_counter_ns() - started) // 1000)
+
+    def record(self, name, us):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = LatencyHistogram()
+            histogram.record(us)
+
+    def timed(self, name):
+        """Décorateur : chaque appel de la fonction (sync ou async) est un span"""
+        def decorator(fn):
+            if iscoroutinefunction(fn):
+                @wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await fn(*args, **kwargs)
+            else:
+                @wraps(fn)
+                def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """{nom: {count, total_ms, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}}, trié par nom"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+        result = {}
+        for name, histogram in items:
+            if not histogram.count:
+                continue
+            p = histogram.percentiles(self.QUANTILES)
+            result[name] = {
+                "count": histogram.count,
+                "total_ms": histogram.total_us / 1000,
+                "mean_ms": round(histogram.total_us / histogram.count / 1000, 3),
+                "p50_ms": p[0.5] / 1000,
+                "p95_ms": p[0.95] / 1000,
+                "p99_ms": p[0.99] / 1000,
+                "max_ms": histogram.max_us / 1000,
+            }
+        return result